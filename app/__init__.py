@@ -11,6 +11,15 @@ def create_app(config_name):
     config[config_name].init_app(app)
 
     db.init_app(app)
+
+    from .uploads import signature_uploader
+    signature_uploader.init_app(app)
+
+    from .cache import response_cache
+    response_cache.init_app(app)
+
+    from .metrics import metrics
+    metrics.init_app(app)
     
     from .api import api as api_blueprint
 
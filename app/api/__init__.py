@@ -2,5 +2,5 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import errors, providers, training
+from . import errors, timing, providers, training, cache, metrics
 
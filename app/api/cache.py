@@ -0,0 +1,13 @@
+from . import api
+from ..cache import response_cache
+from ..catalog import scenario_catalog
+from ..serializers import json_response
+
+
+@api.route('/training/cache/stats')
+def get_cache_stats():
+    """Hit ratios and memory held by the caches of the worker that answers."""
+    return json_response({
+        'responses': response_cache.stats(),
+        'scenarios': scenario_catalog.stats()
+    })
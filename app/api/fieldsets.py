@@ -0,0 +1,64 @@
+"""?fields= and ?include= of the GET routes.
+
+    fields   comma separated keys to keep, dotted paths for nested ones (teacher.first_name)
+    include  comma separated relations to embed (teacher, assistants, assistants.employee)
+
+Without both the response keeps its full shape. Relations that are not selected are never
+loaded, and list endpoints only load the columns they serialize.
+"""
+from flask import request
+from sqlalchemy.orm import load_only
+from ..exceptions import ValidationError
+from ..serializers import Selection, ALL
+
+
+def _paths(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    return [path.strip() for path in value.split(',') if path.strip()]
+
+
+def selection(schema):
+    """Selection of the ?fields= and ?include= query parameters, validated against schema."""
+    fields, include = _paths('fields'), _paths('include')
+    if fields is None and include is None:
+        return ALL
+
+    selected = Selection(fields, include)
+    try:
+        schema.validate(selected)
+    except ValueError as e:
+        raise ValidationError(e.args[0])
+    return selected
+
+
+def key_selection(keys):
+    """Selection for responses built as dicts with the given keys, only ?fields= applies."""
+    fields = _paths('fields')
+    if fields is None:
+        return ALL
+
+    unknown = sorted(set(fields) - set(keys))
+    if unknown:
+        raise ValidationError('unknown fields %s' % ', '.join(unknown))
+    return Selection(fields)
+
+
+def pick(item, selection):
+    if selection.fields is None:
+        return item
+    return dict((key, value) for key, value in item.items() if key in selection.fields)
+
+
+def selected_query(query, schema, selection, keys=()):
+    """Loads only the columns the selection serializes, plus the pagination keys."""
+    if selection.key == ALL.key:
+        return query
+    columns = set(schema.attributes(selection)) | set(key.key for key in keys) | set(['id'])
+    return query.options(load_only(*columns))
+
+
+def serializer(schema, selection):
+    """serialize argument of list_response for a schema and a selection."""
+    return lambda rows: schema.many(rows, selection=selection)
@@ -0,0 +1,9 @@
+from . import api
+from ..metrics import metrics
+from ..serializers import json_response
+
+
+@api.route('/metrics')
+def get_metrics():
+    """Requests by route (count, status codes, latency and db time) and signature uploads, all workers added up."""
+    return json_response(metrics.report())
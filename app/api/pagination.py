@@ -0,0 +1,118 @@
+import base64
+from flask import request, current_app, json, Response, stream_with_context
+from sqlalchemy import tuple_, func
+from ..exceptions import ValidationError
+from .timing import measure
+from ..serializers import json_response, dumps
+
+
+def _to_json(rows):
+    return [row.to_json() for row in rows]
+
+
+def nullable_key(column):
+    """Keyset key of a nullable text column, NULLs sort and compare as '' instead of never matching.
+
+    The key is an expression: the order is served by an index on coalesce(column, '').
+    """
+    return func.coalesce(column, '').label(column.key)
+
+
+def _encode_cursor(row, keys):
+    # a None attribute can only come from a nullable_key, whose value is ''
+    values = [getattr(row, key.key) for key in keys]
+    values = ['' if value is None else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValidationError('cursor is not valid')
+
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValidationError('cursor is not valid')
+
+    return values
+
+
+def _limit():
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    if limit < 1 or limit > current_app.config['API_MAX_PAGE_SIZE']:
+        raise ValidationError('limit must be between 1 and %s' % current_app.config['API_MAX_PAGE_SIZE'])
+    return limit
+
+
+def _flag(name):
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def list_response(query, keys, serialize=_to_json):
+    """Builds the response of a list endpoint using keyset pagination over keys.
+
+    keys must be unique as a whole (end them with the primary key) and never NULL, wrap nullable
+    columns with nullable_key. Query parameters:
+        limit   page size (API_PAGE_SIZE by default, API_MAX_PAGE_SIZE at most)
+        cursor  next_cursor returned by the previous page
+        count   true to add total_elements, it costs an extra COUNT query
+        stream  true to stream every row from a server side cursor instead of paging
+    serialize receives a list of rows and returns a list of dicts.
+    """
+    query = query.order_by(*keys)
+
+    if _flag('stream'):
+        return _stream(query, serialize)
+
+    limit = _limit()
+    page = query
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        page = page.filter(tuple_(*keys) > tuple_(*_decode_cursor(cursor, keys)))
+
+    rows = page.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    with measure('serialize'):
+        body = {
+            'content': serialize(rows),
+            'next_cursor': _encode_cursor(rows[-1], keys) if has_more else None
+        }
+
+    if _flag('count'):
+        body['total_elements'] = query.order_by(None).count()
+
+    with measure('serialize'):
+        return json_response(body)
+
+
+def _stream(query, serialize):
+    chunk_size = current_app.config['API_STREAM_CHUNK_SIZE']
+
+    def generate():
+        yield '{"content":['
+        total = 0
+        chunk = []
+
+        for row in query.yield_per(chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield _dump_chunk(serialize(chunk), total)
+                total += len(chunk)
+                chunk = []
+
+        if chunk:
+            yield _dump_chunk(serialize(chunk), total)
+            total += len(chunk)
+
+        # the total is known for free once every row went through
+        yield '],"total_elements":%d}' % total
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def _dump_chunk(items, written):
+    separator = ',' if written else ''
+    return separator + ','.join(dumps(item) for item in items)
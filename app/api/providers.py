@@ -1,32 +1,97 @@
-from flask import jsonify, request, g, current_app, url_for
+from flask import request, g, current_app, url_for, abort
 from . import api
 from .. import db
 from ..models import Provider, ProviderBranch, ProviderBranchEmployee
 from ..logger import log
+from ..exceptions import ValidationError
+from ..geo import branch_locator
+from .pagination import list_response, nullable_key
+from .conditional import conditional, freshness
+from ..cache import response_cache
+from ..imports import import_employees, FORMATS
+from .. import serializers
+from ..serializers import json_response
+from .fieldsets import selection, key_selection, pick, selected_query, serializer
 
 
 @api.route('/training/providers')
+@conditional(lambda: freshness(Provider) + freshness(ProviderBranch))
+@response_cache.cached(lambda: ['providers'])
 def get_providers(): 
 
-    providers = Provider.query.order_by(Provider.name.asc())
-    return jsonify({
-        'content': [provider.to_json() for provider in providers],
-        'total_elements': providers.count()
-    })
+    keys = (nullable_key(Provider.name), Provider.id)
+    selected = selection(serializers.provider)
+    providers = selected_query(Provider.query, serializers.provider, selected, keys)
+
+    return list_response(providers, keys, serialize=serializer(serializers.provider, selected))
 
 
 @api.route('/training/providers/<string:slug>/branches')
+@conditional(lambda slug: freshness(Provider, Provider.slug == slug) +
+                          freshness(ProviderBranch, ProviderBranch.provider.has(slug=slug)))
+@response_cache.cached(lambda slug: ['provider:%s' % slug])
 def get_branches(slug):
 
     provider = Provider.query.filter(Provider.slug == slug).first_or_404()
 
-    return jsonify({
-        'content': [provider_branch.to_json() for provider_branch in provider.branches],
-        'total_elements': provider.branches.count()
+    keys = (nullable_key(ProviderBranch.name), ProviderBranch.id)
+    selected = selection(serializers.branch)
+    branches = selected_query(provider.branches, serializers.branch, selected, keys)
+
+    return list_response(branches, keys, serialize=serializer(serializers.branch, selected))
+
+
+NEARBY_FIELDS = ('id', 'provider_id', 'name', 'latitude', 'longitude', 'distance_km')
+
+
+@api.route('/training/branches/nearby')
+def get_nearby_branches():
+    """k nearest branches to ?latitude=&longitude=, optionally within radius_km and of one provider."""
+    latitude = request.args.get('latitude', type=float)
+    longitude = request.args.get('longitude', type=float)
+    k = request.args.get('k', 5, type=int)
+    max_radius_km = current_app.config['BRANCH_SEARCH_MAX_RADIUS_KM']
+    radius_km = request.args.get('radius_km', max_radius_km, type=float)
+
+    if latitude is None or not -90 <= latitude <= 90:
+        raise ValidationError('latitude must be between -90 and 90')
+
+    if longitude is None or not -180 <= longitude <= 180:
+        raise ValidationError('longitude must be between -180 and 180')
+
+    if k < 1 or k > 100:
+        raise ValidationError('k must be between 1 and 100')
+
+    if radius_km <= 0 or radius_km > max_radius_km:
+        raise ValidationError('radius_km must be between 0 and %s' % max_radius_km)
+
+    provider_id = None
+    slug = request.args.get('provider')
+    if slug is not None:
+        provider_id = db.session.query(Provider.id).filter(Provider.slug == slug).scalar()
+        if provider_id is None:
+            abort(404)
+
+    selected = key_selection(NEARBY_FIELDS)
+    nearest = branch_locator.index().nearest(latitude, longitude, k, radius_km, provider_id)
+
+    return json_response({
+        'content': [pick({
+            'id': branch_id,
+            'provider_id': branch_provider_id,
+            'name': name,
+            'latitude': branch_latitude,
+            'longitude': branch_longitude,
+            'distance_km': distance
+        }, selected) for distance, (branch_id, branch_provider_id, name, branch_latitude, branch_longitude) in nearest],
+        'total_elements': len(nearest)
     })
 
 
 @api.route('/training/providers/<string:slug>/branches/<int:branch_id>/employees', methods=['GET'])
+@conditional(lambda slug, branch_id: freshness(ProviderBranch, ProviderBranch.id == branch_id, ProviderBranch.provider.has(slug=slug)) +
+                                     freshness(ProviderBranchEmployee, ProviderBranchEmployee.provider_branch_id == branch_id))
+@response_cache.cached(lambda slug, branch_id: ['branch:%s' % branch_id])
 def get_employees(slug, branch_id):
 
     log.info('get_employees: slug %s branch_id: %s' % (slug, branch_id))
@@ -34,10 +99,11 @@ def get_employees(slug, branch_id):
     branch = ProviderBranch.query.filter(ProviderBranch.provider.has(slug=slug)) \
                                  .filter(ProviderBranch.id == branch_id).first_or_404()
 
-    return jsonify({
-        'content': [employee.to_json() for employee in branch.employees],
-        'total_elements': branch.employees.count()
-    })
+    keys = (ProviderBranchEmployee.name, ProviderBranchEmployee.id)
+    selected = selection(serializers.employee)
+    employees = selected_query(branch.employees, serializers.employee, selected, keys)
+
+    return list_response(employees, keys, serialize=serializer(serializers.employee, selected))
 
 
 @api.route('/training/providers/<string:slug>/branches/<int:branch_id>/employees', methods=['POST'])
@@ -53,4 +119,31 @@ def new_employee(slug, branch_id):
     employee.branch = branch
     db.session.add(employee)
     db.session.commit()
-    return jsonify(employee.to_json()), 201
+    return json_response(employee.to_json()), 201
+
+
+# bulk import of a provider's employees, the body is streamed and never held in memory:
+#   - text/csv with a header line: branch_id,name,phone,title
+#   - application/x-ndjson: one {"branch_id", "name", "phone", "title"} object per line
+# ?branch_id= is the branch of the rows without one, ?format=csv|ndjson overrides the content type
+# invalid rows are skipped and reported by line, the valid ones are imported
+@api.route('/training/providers/<string:slug>/employees/import', methods=['POST'])
+def import_provider_employees(slug):
+
+    log.info('import_provider_employees: slug %s' % slug)
+
+    provider = Provider.query.filter(Provider.slug == slug).first_or_404()
+
+    format = request.args.get('format') or FORMATS.get(request.mimetype)
+    if format is None:
+        raise ValidationError('Content-Type must be one of %s' % ', '.join(sorted(FORMATS)))
+
+    branch_id = request.args.get('branch_id')
+    if branch_id is not None:
+        if not branch_id.isdigit():
+            raise ValidationError('branch_id %s is not valid' % branch_id)
+        branch_id = int(branch_id)
+
+    result = import_employees(request.stream, format, provider_id=provider.id, branch_id=branch_id)
+    db.session.commit()
+    return json_response(result), 200
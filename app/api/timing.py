@@ -0,0 +1,76 @@
+import time
+from contextlib import contextmanager
+from flask import g, request, current_app
+from flask.ext.sqlalchemy import get_debug_queries
+from . import api
+from ..logger import log
+from ..metrics import metrics as request_metrics
+
+# Server-Timing metrics besides db, in the order they are reported
+PHASES = ('serialize', 'storage')
+
+
+def _db_time(queries):
+    return sum(query.duration for query in queries)
+
+
+@contextmanager
+def measure(phase):
+    """Adds the time spent in the block to the phase of the current request.
+
+    Queries issued inside the block are left out, they are already reported as db time.
+    """
+    before = len(get_debug_queries())
+    start = time.time()
+    yield
+    elapsed = time.time() - start - _db_time(get_debug_queries()[before:])
+
+    timings = getattr(g, 'timings', None)
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0) + elapsed
+
+
+@api.before_request
+def start_timing():
+    g.timings = {}
+    g.request_start = time.time()
+
+
+def _truncated(value, length=500):
+    value = repr(value)
+    return value if len(value) <= length else value[:length] + '...'
+
+
+# streamed responses run their queries after this hook, those are not accounted for
+@api.after_request
+def report_timing(response):
+    if not hasattr(g, 'request_start'):
+        return response
+
+    queries = get_debug_queries()
+    db_time = _db_time(queries)
+    total = time.time() - g.request_start
+
+    slow = current_app.config['APP_SLOW_DB_QUERY_TIME']
+    for query in queries:
+        if query.duration >= slow:
+            log.warning('slow query %.3fs on %s (%s): %s parameters: %s' %
+                        (query.duration, request.endpoint, query.context, query.statement, _truncated(query.parameters)))
+
+    max_queries = current_app.config['APP_MAX_QUERIES_PER_REQUEST']
+    if max_queries and len(queries) > max_queries:
+        log.warning('%s %s issued %s queries, the limit is %s' % (request.method, request.path, len(queries), max_queries))
+
+    metrics = ['db;dur=%.1f;desc="%d queries"' % (db_time * 1000, len(queries))]
+    for phase in PHASES:
+        if phase in g.timings:
+            metrics.append('%s;dur=%.1f' % (phase, g.timings[phase] * 1000))
+    metrics.append('total;dur=%.1f' % (total * 1000))
+
+    response.headers['Server-Timing'] = ', '.join(metrics)
+
+    if request.url_rule is not None:
+        route = '%s %s' % (request.method, request.url_rule.rule)
+        request_metrics.observe_request(route, response.status_code, total, db_time, len(queries))
+
+    return response
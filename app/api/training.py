@@ -1,25 +1,43 @@
-from flask import jsonify, request, g, current_app, url_for
+from flask import request, g, current_app, url_for, abort, Response, stream_with_context
 from . import api
 from .. import db
-from ..models import ProviderBranchEmployee, TrainingBatch, TrainingSession, TrainingSessionAssistant, TrainingScenario, TrainingSessionAssistantScore
+from ..models import TrainingBatch, TrainingSession, TrainingSessionAssistant, TrainingScenario, ScoreRollup
 from ..logger import log
 from ..exceptions import ValidationError
-from ..s3 import upload_to_s3
+from ..uploads import signature_uploader
+from .pagination import list_response, nullable_key
+from .conditional import conditional, freshness
+from .timing import measure
+from ..cache import response_cache
+from ..stats import batch_stats, DIMENSIONS, VALUES
+from ..catalog import scenario_catalog
+from ..scoring import add_session_assistants
+from ..loaders import sessions_query, sessions_to_json, session_to_json
+from ..exports import export_batch, FORMATS as EXPORT_FORMATS
+from ..sync import sync_sessions
+from .. import serializers
+from ..serializers import json_response
+from .fieldsets import selection, key_selection, pick, selected_query, serializer
 import base64
+import os
 
 
 #############################
 # GET ALL TRAINING SCENARIOS
 #############################
 @api.route('/training/scenarios')
+@conditional(lambda: freshness(TrainingScenario))
 def get_scenarios():
     log.info('get_scenarios')
 
-    scenarios = TrainingScenario.query.order_by(TrainingScenario.description)
+    selected = key_selection([key for key, source in serializers.scenario.fields])
 
-    return jsonify({
-        'content': [scenario.to_json() for scenario in scenarios],
-        'total_elements': scenarios.count()
+    # the catalog is tiny and cached per worker, so it is returned whole
+    scenarios = [pick(scenario, selected) for scenario in scenario_catalog.all()]
+
+    return json_response({
+        'content': scenarios,
+        'total_elements': len(scenarios)
     })
 
 
@@ -27,15 +45,15 @@ def get_scenarios():
 # GET ALL TRAINING BATCHES
 #############################
 @api.route('/training/batches')
+@conditional(lambda: freshness(TrainingBatch))
 def get_batches():
     log.info('get_batches')
 
-    batches = TrainingBatch.query.order_by(TrainingBatch.name.asc())
+    keys = (nullable_key(TrainingBatch.name), TrainingBatch.id)
+    selected = selection(serializers.batch)
+    batches = selected_query(TrainingBatch.query, serializers.batch, selected, keys)
 
-    return jsonify({
-        'content': [batch.to_json() for batch in batches],
-        'total_elements': batches.count()
-    })
+    return list_response(batches, keys, serialize=serializer(serializers.batch, selected))
 
 
 #############################
@@ -50,36 +68,110 @@ def new_batch():
     db.session.add(batch)
     db.session.commit()
 
-    return jsonify(batch.to_json()), 201
+    return json_response(batch.to_json()), 201
+
+
+#############################
+# GET SCORE STATS OF A BATCH
+#############################
+@api.route('/training/batches/<int:batch_id>/stats')
+@conditional(lambda batch_id: freshness(TrainingBatch, TrainingBatch.id == batch_id) +
+                              freshness(ScoreRollup, ScoreRollup.scope == ScoreRollup.BATCH, ScoreRollup.scope_id == batch_id))
+@response_cache.cached(lambda batch_id: ['batch-scores:%s' % batch_id])
+def get_batch_stats(batch_id):
+    log.info('get_batch_stats: batch_id %s' % batch_id)
+
+    TrainingBatch.query.filter(TrainingBatch.id == batch_id).first_or_404()
+
+    buckets = request.args.get('buckets', 10, type=int)
+    if buckets < 1 or buckets > 100:
+        raise ValidationError('buckets must be between 1 and 100')
+
+    # ?include= picks the report keys (grouping sets) and ?fields= the values of every group
+    values = key_selection(VALUES).fields
+    include = request.args.get('include')
+    dimensions = None
+    if include is not None:
+        dimensions = set(key.strip() for key in include.split(',') if key.strip())
+        unknown = dimensions - set(key for key, id_column, name_column in DIMENSIONS.values())
+        if unknown:
+            raise ValidationError('unknown include %s' % ', '.join(sorted(unknown)))
+
+    stats = batch_stats(batch_id, buckets, dimensions, values)
+
+    with measure('serialize'):
+        return json_response(stats)
+
+
+#############################
+# EXPORT THE SCORES OF A BATCH
+#############################
+# one flat row per score streamed from a server side cursor, ?format=csv (default) or ndjson,
+# ?gzip=true compresses the stream into a .gz download
+@api.route('/training/batches/<int:batch_id>/export')
+def export_training_batch(batch_id):
+    log.info('export_training_batch: batch_id %s' % batch_id)
+
+    TrainingBatch.query.filter(TrainingBatch.id == batch_id).first_or_404()
+
+    format = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    chunks = export_batch(batch_id, format, compress)
+
+    filename = 'batch-%s.%s' % (batch_id, format)
+    if compress:
+        filename += '.gz'
+    response = Response(stream_with_context(chunks), mimetype='application/gzip' if compress else EXPORT_FORMATS[format])
+    response.headers['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
 
 
 #############################
 # GET ALL SESSIONS BY BATCH
 #############################
 @api.route('/training/batches/<int:batch_id>/sessions')
+@conditional(lambda batch_id: freshness(TrainingSession, TrainingSession.training_batch_id == batch_id) +
+                              freshness(TrainingSessionAssistant, TrainingSessionAssistant.session.has(training_batch_id=batch_id)))
 def get_training_sessions_by_batch(batch_id):
     log.info('get_training_sessions_by_batch: batch_id %s ' % batch_id)
 
-    sessions = TrainingSession.query.filter(TrainingSession.training_batch_id == batch_id)
+    selected = selection(serializers.session)
+    sessions = sessions_query(selected).filter(TrainingSession.training_batch_id == batch_id)
 
-    return jsonify({
-        'content': [session.to_json() for session in sessions],
-        'total_elements': sessions.count()
-    })
+    return list_response(sessions, (TrainingSession.id,), serialize=lambda rows: sessions_to_json(rows, selected))
 
 
 #############################
 # GET A SINGLE SESSION BY ID
 #############################
 @api.route('/training/batches/<int:batch_id>/sessions/<int:session_id>', methods=['GET'])
+@conditional(lambda batch_id, session_id: freshness(TrainingSession, TrainingSession.id == session_id, TrainingSession.training_batch_id == batch_id) +
+                                          freshness(TrainingSessionAssistant, TrainingSessionAssistant.training_session_id == session_id))
 def get_training_session(batch_id, session_id):
 
     log.info('get_training_session: batch_id %s session_id: %s' % (batch_id, session_id))
 
-    session = TrainingSession.query.filter(TrainingSession.training_batch_id == batch_id) \
-                                   .filter(TrainingSession.id == session_id).first_or_404()
+    selected = selection(serializers.session)
+
+    # finished sessions are served as rendered when they were finished, unless only some fields are asked for
+    if selected is serializers.ALL:
+        frozen = db.session.query(TrainingSession.serialized_json).filter(TrainingSession.id == session_id) \
+                                                                  .filter(TrainingSession.training_batch_id == batch_id).first()
+        if frozen is None:
+            abort(404)
+
+        if frozen.serialized_json is not None:
+            return Response(frozen.serialized_json, mimetype='application/json')
+
+    session = sessions_query(selected).filter(TrainingSession.training_batch_id == batch_id) \
+                                      .filter(TrainingSession.id == session_id)
 
-    return jsonify(session.to_json())
+    with measure('serialize'):
+        session = sessions_to_json(session, selected)
+        if not session:
+            abort(404)
+
+        return json_response(session[0])
 
 
 #############################
@@ -98,7 +190,28 @@ def new_training_session(batch_id):
 
     db.session.add(session)
     db.session.commit()
-    return jsonify(session.to_json()), 201
+    return json_response(session_to_json(session.id)), 201
+
+
+##########################################
+# SYNC SESSIONS RECORDED OFFLINE IN BULK
+##########################################
+# body {"sessions": [...]}, every item a complete session: the fields of a new session, its
+# assistants as in the PATCH below, an optional finish {"comments", "signature_base64"} and a
+# client generated idempotency_key, so a retried upload does not create the sessions again.
+# Each item is committed on its own and has a result: created, duplicate or error (with message)
+@api.route('/training/batches/<int:batch_id>/sync', methods=['POST'])
+def sync_training_sessions(batch_id):
+
+    log.info('sync_training_sessions: batch_id %s' % batch_id)
+
+    batch = TrainingBatch.query.filter(TrainingBatch.id == batch_id).first_or_404()
+
+    sessions = (request.get_json() or {}).get('sessions')
+    if not isinstance(sessions, list):
+        raise ValidationError('sessions must be a list')
+
+    return json_response({'content': sync_sessions(batch, sessions)}), 200
 
 
 ######################################
@@ -113,7 +226,7 @@ def add_assistants_to_training_session(batch_id, session_id):
     session = TrainingSession.query.filter(TrainingSession.training_batch_id == batch_id) \
                                    .filter(TrainingSession.id == session_id).first_or_404()
     # constraints
-    if session.signature_url is not None:
+    if session.signature_url is not None or session.status != TrainingSession.OPEN:
         raise ValidationError('Training session is already completed, you cannot add new assistants to it')
 
     # check body to find assistant field
@@ -123,64 +236,55 @@ def add_assistants_to_training_session(batch_id, session_id):
 
     log.info('assistants: %s' % len(assistants))
 
-    for i, assistant in enumerate(assistants):
+    add_session_assistants(session, assistants)
 
-        employee = session.provider_branch.employees.filter(ProviderBranchEmployee.id == assistant['employee_id']).first()
-        if employee is None:
-            raise ValidationError('Employee %s does not exist' % assistant['employee_id'])
-
-        if assistant['results'] is None:
-            raise ValidationError('scores array on assistant #%s' % assistant['employee_id'])
-
-
-        session_assistant = TrainingSessionAssistant()
-        session_assistant.employee = employee
-        session_assistant.session = session
-
-        log.info('Training session id: %s employee: %s', (session.id, employee.name))
-
-        for x, result in enumerate(assistant['results']):
-
-            if result['scenario_id'] is None:
-                raise ValidationError('scenario_id is null in result [%s] of assistant #%s' % (x + 1, assistant['employee_id']))
+    db.session.commit()
+    return json_response(session_to_json(session.id)), 200
 
-            scenario = TrainingScenario.query.filter(TrainingScenario.id == result['scenario_id']).first()
-            if scenario is None:
-                raise ValidationError('scenario in result [%s] of assistant #%s does not exist' % (x + 1, assistant['employee_id']))
 
-            if result['score'] is None:
-                raise ValidationError('score in result [%s] of assistant #%s is null' % (x + 1, assistant['employee_id']))
+def _finishable_session(batch_id, session_id):
+    # the row stays locked until the request commits: a concurrent finish waits, then sees it finishing
+    session = TrainingSession.query.filter(TrainingSession.training_batch_id == batch_id) \
+                                   .filter(TrainingSession.id == session_id).with_for_update().first_or_404()
 
-            if result['score'] < 0 or result['score'] > 100:
-                raise ValidationError('score in result [%s] of assistant #%s is outside of permitted scope [0-100]' % (x + 1, assistant['employee_id']))
+    log.info('signature_url %s status %s' % (session.signature_url, session.status))
 
-            scenario_score = TrainingSessionAssistantScore(score=result['score'])
-            scenario_score.scenario = scenario
-            session_assistant.scores.append(scenario_score)
+    if session.signature_url is not None or session.status != TrainingSession.OPEN:
+        raise ValidationError('Training session is already completed')
 
-            log.info('Training session id: %s employee: %s scenario: %s score %s', (session.id, employee.name, scenario.description, scenario_score.score))
+    return session
 
-        db.session.add(session_assistant)
 
+def _finish(session, comments, spooled, checksum):
+    # the upload runs in the background, clients poll the session until its status is finished
+    session.comments = comments
+    session.signature_sha256 = checksum
+    session.status = TrainingSession.FINISHING
+    session_id = session.id
+    try:
+        db.session.flush()
+    except Exception:
+        os.remove(spooled)
+        raise
+
+    # the row is locked since _finishable_session, so this request's signature is the session's
+    signature_uploader.keep(spooled, session_id)
     db.session.commit()
-    return jsonify(session.to_json()), 200
+
+    signature_uploader.submit(session_id)
+    return session_to_json(session_id)
 
 
 ######################################
 # FINISH A SESSION AND UPLOAD SIGNATURE
 ######################################
+# responds 202 with status 'finishing', signature_url is filled in once the upload is done
 @api.route('/training/batches/<int:batch_id>/sessions/<int:session_id>/finish', methods=['POST'])
 def finish_training_session(batch_id, session_id):
     log.info('finish_training_session: batch_id %s session_id: %s' % (batch_id, session_id))
     # log.info('request: %s' % request.json)
 
-    session = TrainingSession.query.filter(TrainingSession.training_batch_id == batch_id) \
-                                   .filter(TrainingSession.id == session_id).first_or_404()
-
-    log.info('signature_url %s' % session.signature_url)
-
-    if session.signature_url is not None:
-        raise ValidationError('Training session is already completed')
+    session = _finishable_session(batch_id, session_id)
 
     json = request.json
 
@@ -193,10 +297,53 @@ def finish_training_session(batch_id, session_id):
         raise ValidationError('Signature cannot be null')
 
     file = base64.b64decode(json.get('signature_base64'))
-    result_url = upload_to_s3(file, '/training/signatures/' + str(session.id) + ".jpg")
+    with measure('storage'):
+        spooled, size, checksum = signature_uploader.spool(file)
 
-    # save the url from the uploaded image
-    session.comments = comments
-    session.signature_url = result_url
-    db.session.commit()
-    return jsonify(session.to_json()), 200
+    return json_response(_finish(session, comments, spooled, checksum)), 202
+
+
+###########################################
+# FINISH A SESSION STREAMING THE SIGNATURE
+###########################################
+# same as /finish but the signature is sent as binary instead of base64 inside the json body:
+#   - raw body with Content-Type image/jpeg, comments in the query string
+#   - multipart/form-data with a 'signature' file and a 'comments' field
+# the body is copied to the spool in chunks, an optional X-Signature-Sha256 header is verified
+@api.route('/training/batches/<int:batch_id>/sessions/<int:session_id>/signature', methods=['POST'])
+def upload_training_session_signature(batch_id, session_id):
+    log.info('upload_training_session_signature: batch_id %s session_id: %s' % (batch_id, session_id))
+
+    if request.content_length is not None and request.content_length > current_app.config['SIGNATURE_MAX_BYTES']:
+        abort(413)
+
+    session = _finishable_session(batch_id, session_id)
+
+    if request.mimetype == 'multipart/form-data':
+        # werkzeug already spools big parts to a temporary file while parsing
+        comments = request.form.get('comments')
+        signature = request.files.get('signature')
+        stream = signature.stream if signature is not None else None
+    else:
+        comments = request.args.get('comments')
+        stream = request.stream
+
+    if comments is None:
+        raise ValidationError('comments cannot be empty')
+
+    if stream is None:
+        raise ValidationError('Signature cannot be null')
+
+    with measure('storage'):
+        spooled, size, checksum = signature_uploader.spool_stream(stream)
+
+    expected = request.headers.get('X-Signature-Sha256')
+    if expected is not None and expected.lower() != checksum:
+        os.remove(spooled)
+        raise ValidationError('Signature checksum does not match, expected %s got %s' % (expected, checksum))
+
+    log.info('signature of session %s spooled: %s bytes sha256 %s' % (session.id, size, checksum))
+
+    response = json_response(_finish(session, comments, spooled, checksum))
+    response.headers['X-Signature-Sha256'] = checksum
+    return response, 202
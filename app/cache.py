@@ -0,0 +1,280 @@
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, Response
+from flask.ext.sqlalchemy import SignallingSession
+from sqlalchemy import event, select, or_, inspect
+from . import db
+from .models import Provider, ProviderBranch, ProviderBranchEmployee
+from .logger import log
+
+
+class MemoryBackend(object):
+    """LRU of response bodies held by the worker process, bounded by their total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.pop(key, None)
+            if body is not None:
+                self._entries[key] = body
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+
+            self._entries[key] = body
+            self.bytes += len(body)
+
+            while self.bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class FileBackend(object):
+    """Response bodies as files in a directory shared by every gunicorn worker of the host.
+
+    Hits touch the file, so when the directory grows past max_bytes the least recently used
+    entries (oldest mtime) are evicted first.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.bytes = self._scan()[1]
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries, sum(size for mtime, size, name in entries)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                body = f.read()
+            os.utime(self._path(key), None)
+            return body
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.rename(tmp_path, self._path(key))
+
+        with self._lock:
+            self.bytes += len(body)
+            if self.bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # other workers write to the same directory, so the real size is measured again
+        entries, self.bytes = self._scan()
+        for mtime, size, name in sorted(entries):
+            if self.bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {'bytes': self.bytes, 'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class ResponseCache(object):
+    """Caches GET responses by route + arguments, invalidated by tags on every model write.
+
+    Each cached view declares the tags its response depends on (e.g. provider:<slug>). A tag
+    has a version stored as a small file under RESPONSE_CACHE_DIR/tags, shared by every worker,
+    and the versions are part of the cache key: invalidating a tag writes a new version, which
+    makes the old entries unreachable in every worker at once; they age out of the LRU.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['response_cache'] = self
+        self.tags_dir = os.path.join(app.config['RESPONSE_CACHE_DIR'], 'tags')
+        backend = app.config['RESPONSE_CACHE_BACKEND']
+
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config['RESPONSE_CACHE_MAX_BYTES'])
+        elif backend == 'file':
+            self.backend = FileBackend(os.path.join(app.config['RESPONSE_CACHE_DIR'], 'entries'), app.config['RESPONSE_CACHE_MAX_BYTES'])
+        elif backend is None:
+            self.backend = None
+        else:
+            raise ValueError('unknown RESPONSE_CACHE_BACKEND %s' % backend)
+
+        if self.backend is not None and not os.path.isdir(self.tags_dir):
+            os.makedirs(self.tags_dir)
+
+    def _tag_version(self, tag):
+        try:
+            with open(os.path.join(self.tags_dir, tag), 'r') as f:
+                return f.read()
+        except (IOError, OSError):
+            return ''
+
+    def invalidate(self, tags):
+        if self.backend is None:
+            return
+
+        for tag in tags:
+            fd, tmp_path = tempfile.mkstemp(dir=self.tags_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(uuid.uuid4().hex)
+            os.rename(tmp_path, os.path.join(self.tags_dir, tag))
+
+        log.info('response cache invalidated %s' % ', '.join(sorted(tags)))
+
+    def _key(self, tags):
+        versions = ['%s=%s' % (tag, self._tag_version(tag)) for tag in tags]
+        return hashlib.sha1(('%s|%s' % (request.full_path, '|'.join(versions))).encode('utf-8')).hexdigest()
+
+    def cached(self, tags):
+        """Caches the 200 responses of a view, tags receives the view arguments."""
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if self.backend is None:
+                    return f(*args, **kwargs)
+
+                key = self._key(tags(*args, **kwargs))
+                body = self.backend.get(key)
+                if body is not None:
+                    self.hits += 1
+                    return Response(body, mimetype='application/json')
+
+                self.misses += 1
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    self.backend.set(key, response.get_data())
+                return response
+            return decorated
+        return decorator
+
+    def stats(self):
+        requests = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / requests if requests else None
+        }
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_on_commit(tags):
+    """Invalidates tags once the current transaction commits, for writes that bypass the ORM."""
+    db.session().info.setdefault('cache_tags', set()).update(tags)
+
+
+def provider_tags(slugs):
+    return set(['providers']) | set('provider:%s' % slug for slug in slugs)
+
+
+def _values(instance, key):
+    # the current value and, when the flush changed it, the previous one: a renamed slug or a
+    # moved branch or employee leaves stale responses under the old key too
+    history = inspect(instance).attrs[key].history
+    return set(history.added) | set(history.unchanged) | set(history.deleted) | set([getattr(instance, key)])
+
+
+# db.session is a scoped_session, which session events do not accept: they go on the class of
+# the sessions it creates
+@event.listens_for(SignallingSession, 'after_flush')
+def _collect_tags(session, flush_context):
+    provider_ids = set()
+    branch_ids = set()
+    slugs = set()
+
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Provider):
+            slugs.update(_values(instance, 'slug'))
+            provider_ids.add(instance.id)
+        elif isinstance(instance, ProviderBranch):
+            provider_ids.update(_values(instance, 'provider_id'))
+            branch_ids.add(instance.id)
+        elif isinstance(instance, ProviderBranchEmployee):
+            branch_ids.update(_values(instance, 'provider_branch_id'))
+
+    if not provider_ids and not branch_ids:
+        return
+
+    tags = session.info.setdefault('cache_tags', set())
+    tags.update('branch:%s' % branch_id for branch_id in branch_ids if branch_id is not None)
+
+    # the branch listing of a provider and the provider listing embed employee counts
+    criteria = []
+    if provider_ids - set([None]):
+        criteria.append(Provider.id.in_(provider_ids - set([None])))
+    if branch_ids - set([None]):
+        criteria.append(Provider.id.in_(select([ProviderBranch.provider_id]).where(ProviderBranch.id.in_(branch_ids - set([None])))))
+
+    if criteria:
+        slugs.update(slug for slug, in session.connection().execute(select([Provider.slug]).where(or_(*criteria))))
+
+    tags.update(provider_tags(slug for slug in slugs if slug is not None))
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _invalidate_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        response_cache.invalidate(tags)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _discard_tags(session):
+    session.info.pop('cache_tags', None)
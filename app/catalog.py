@@ -0,0 +1,101 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, func
+from . import db
+from .models import TrainingScenario
+from .logger import log
+
+
+class ScenarioCatalog(object):
+    """Per worker cache of the training scenarios.
+
+    The catalog is served from memory for SCENARIO_CATALOG_TTL seconds, then a single aggregate
+    query (count, max(id), max(updated_at)) tells whether another worker changed the table, and
+    the scenarios are only reloaded when that version moved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scenarios = None
+        self._by_id = {}
+        self._version = None
+        self._expires_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.version_checks = 0
+
+    def _load_version(self):
+        self.version_checks += 1
+        return tuple(db.session.query(func.count(TrainingScenario.id),
+                                      func.max(TrainingScenario.id),
+                                      func.max(TrainingScenario.updated_at)).one())
+
+    def _refresh(self, force=False):
+        ttl = current_app.config['SCENARIO_CATALOG_TTL']
+
+        if not force and self._scenarios is not None and time.time() < self._expires_at:
+            self.hits += 1
+            return
+
+        # the queries run outside the lock: it is built at import, before gevent workers patch
+        # threading, and a greenlet waiting on the database while holding it would block the worker
+        version = self._load_version()
+        if self._scenarios is not None and version == self._version:
+            self.hits += 1
+            self._expires_at = time.time() + ttl
+            return
+
+        self.misses += 1
+        scenarios = [scenario.to_json() for scenario in TrainingScenario.query.order_by(TrainingScenario.description, TrainingScenario.id)]
+        by_id = dict((scenario['id'], scenario) for scenario in scenarios)
+
+        with self._lock:
+            self._scenarios = scenarios
+            self._by_id = by_id
+            self._version = version
+            self._expires_at = time.time() + ttl
+        log.info('scenario catalog loaded: %s scenarios' % len(scenarios))
+
+    def all(self):
+        """Scenarios as dicts, ordered by description."""
+        self._refresh()
+        return self._scenarios
+
+    def existing(self, ids):
+        """Returns the subset of ids that are known scenarios.
+
+        An unknown id may have been added by another worker inside the TTL, so the version is
+        checked again before reporting it as missing.
+        """
+        self._refresh()
+        ids = set(ids)
+        found = ids.intersection(self._by_id)
+        if found != ids:
+            self._refresh(force=True)
+            found = ids.intersection(self._by_id)
+        return found
+
+    def invalidate(self):
+        self._expires_at = 0
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'version_checks': self.version_checks,
+            'hit_ratio': float(self.hits) / requests if requests else None,
+            'size': len(self._by_id)
+        }
+
+
+scenario_catalog = ScenarioCatalog()
+
+
+@event.listens_for(TrainingScenario, 'after_insert')
+@event.listens_for(TrainingScenario, 'after_update')
+@event.listens_for(TrainingScenario, 'after_delete')
+def _scenario_changed(mapper, connection, target):
+    # writes made by this worker are seen on the next read, the rest wait for the version check
+    scenario_catalog.invalidate()
@@ -0,0 +1,29 @@
+from sqlalchemy import select, func
+from . import db
+from .models import Provider, ProviderBranch, ProviderBranchEmployee, TrainingBatch, TrainingSession
+
+# (parent, counter column, child, foreign key on the child) kept by the counter_cache trigger
+COUNTER_CACHES = (
+    (Provider, 'branches_count', ProviderBranch, 'provider_id'),
+    (ProviderBranch, 'employees_count', ProviderBranchEmployee, 'provider_branch_id'),
+    (TrainingBatch, 'sessions_count', TrainingSession, 'training_batch_id'),
+)
+
+
+def recount():
+    """Recomputes every counter cache column, returns {counter: rows that were out of sync}."""
+    repaired = {}
+
+    for parent, counter, child, foreign_key in COUNTER_CACHES:
+        parent_table = parent.__table__
+        child_table = child.__table__
+
+        actual = select([func.count()]).where(child_table.c[foreign_key] == parent_table.c.id).as_scalar()
+        result = db.session.execute(parent_table.update()
+                                                .where(parent_table.c[counter] != actual)
+                                                .values({counter: actual}))
+
+        repaired['%s.%s' % (parent_table.name, counter)] = result.rowcount
+
+    db.session.commit()
+    return repaired
@@ -0,0 +1,117 @@
+import datetime
+import zlib
+import six
+from flask import current_app
+from . import db, serializers
+from .models import Provider, ProviderBranch, ProviderBranchEmployee, User, TrainingBatch, TrainingScenario, \
+    TrainingSession, TrainingSessionAssistant, TrainingSessionAssistantScore
+from .exceptions import ValidationError
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# one row per score, in this column order
+COLUMNS = (
+    ('batch_id', TrainingBatch.id),
+    ('batch_name', TrainingBatch.name),
+    ('session_id', TrainingSession.id),
+    ('session_status', TrainingSession.status),
+    ('session_created_at', TrainingSession.created_at),
+    ('session_updated_at', TrainingSession.updated_at),
+    ('provider_slug', Provider.slug),
+    ('branch_id', ProviderBranch.id),
+    ('branch_name', ProviderBranch.name),
+    ('teacher_id', User.id),
+    ('teacher_first_name', User.first_name),
+    ('teacher_last_name', User.last_name),
+    ('employee_id', ProviderBranchEmployee.id),
+    ('employee_name', ProviderBranchEmployee.name),
+    ('scenario_id', TrainingScenario.id),
+    ('scenario_description', TrainingScenario.description),
+    ('score', TrainingSessionAssistantScore.score),
+    ('scored_at', TrainingSessionAssistantScore.created_at),
+)
+NAMES = [name for name, column in COLUMNS]
+
+
+def batch_rows_query(batch_id):
+    """The flat score rows of a batch, ordered by session, assistant and score."""
+    return db.session.query(*[column for name, column in COLUMNS]) \
+        .select_from(TrainingSessionAssistantScore) \
+        .join(TrainingSessionAssistant, TrainingSessionAssistant.id == TrainingSessionAssistantScore.training_session_assistant_id) \
+        .join(TrainingSession, TrainingSession.id == TrainingSessionAssistant.training_session_id) \
+        .join(TrainingBatch, TrainingBatch.id == TrainingSession.training_batch_id) \
+        .join(ProviderBranch, ProviderBranch.id == TrainingSession.provider_branch_id) \
+        .join(Provider, Provider.id == ProviderBranch.provider_id) \
+        .join(User, User.id == TrainingSession.teacher_id) \
+        .join(ProviderBranchEmployee, ProviderBranchEmployee.id == TrainingSessionAssistant.provider_branch_employee_id) \
+        .join(TrainingScenario, TrainingScenario.id == TrainingSessionAssistantScore.training_scenario_id) \
+        .filter(TrainingSession.training_batch_id == batch_id) \
+        .order_by(TrainingSession.id, TrainingSessionAssistant.id, TrainingSessionAssistantScore.id)
+
+
+def _iso(value):
+    # ISO 8601 in both formats, with the offset and the microseconds the HTTP dates of the api drop
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _csv_value(value):
+    if value is None:
+        return u''
+    value = six.text_type(_iso(value))
+    if any(c in value for c in u'",\r\n'):
+        return u'"%s"' % value.replace(u'"', u'""')
+    return value
+
+
+def _csv_lines(rows):
+    return u''.join(u','.join(_csv_value(value) for value in row) + u'\r\n' for row in rows)
+
+
+def _ndjson_lines(rows):
+    return u''.join(serializers.dumps(dict(zip(NAMES, [_iso(value) for value in row]))) + u'\n' for row in rows)
+
+
+def export_batch(batch_id, format, compress=False):
+    """Generator of the scores of a batch as csv or ndjson bytes, gzipped when compress is set.
+
+    The rows come from one joined query read through a server side cursor EXPORT_CHUNK_ROWS at
+    a time, and every chunk is encoded (and compressed) before the next one is fetched, so the
+    memory used does not depend on the size of the batch.
+    """
+    # checked before the response starts streaming, as a 422
+    if format not in FORMATS:
+        raise ValidationError('format must be one of %s' % ', '.join(sorted(FORMATS)))
+
+    return _generate(batch_id, format, compress, current_app.config['EXPORT_CHUNK_ROWS'])
+
+
+def _generate(batch_id, format, compress, chunk_rows):
+    lines = _csv_lines if format == 'csv' else _ndjson_lines
+    # wbits 16 + MAX_WBITS writes the gzip header and trailer instead of a bare zlib stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    def encode(text):
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor is not None else data
+
+    if format == 'csv':
+        yield encode(u','.join(NAMES) + u'\r\n')
+
+    # plain rows from a named (server side) cursor, without the ORM result processing
+    result = db.session.connection().execution_options(stream_results=True).execute(batch_rows_query(batch_id).statement)
+    try:
+        while True:
+            rows = result.fetchmany(chunk_rows)
+            if not rows:
+                break
+            data = encode(lines(rows))
+            # the compressor holds small chunks back until it has a block worth writing
+            if data:
+                yield data
+    finally:
+        result.close()
+
+    if compressor is not None:
+        yield compressor.flush()
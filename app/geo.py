@@ -0,0 +1,178 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import event, func
+from . import db
+from .models import ProviderBranch
+from .logger import log
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = math.sin((latitude2 - latitude1) / 2) ** 2 + \
+        math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class BranchIndex(object):
+    """Branches bucketed in a grid of cell_degrees x cell_degrees cells.
+
+    Points are (id, provider_id, name, latitude, longitude) tuples. A lookup only visits the
+    cells around the query point, so its cost depends on the local density, not on the total.
+    """
+
+    def __init__(self, points, cell_degrees=0.05):
+        # the columns have to wrap exactly at the antimeridian for the ring bounds to hold
+        columns = 360.0 / cell_degrees if cell_degrees > 0 else 0
+        if columns < 1 or abs(columns - round(columns)) > 1e-9 * columns:
+            raise ValueError('cell_degrees must divide 360, got %s' % cell_degrees)
+
+        self.cell_degrees = cell_degrees
+        self.cells = defaultdict(list)
+        self.points = {}
+
+        for point in points:
+            self.points[point[0]] = point
+            self.cells[self._cell(point[3], point[4])].append(point)
+
+        rows = [cell[0] for cell in self.cells] or [0]
+        self.min_row, self.max_row = min(rows), max(rows)
+
+    def _cell(self, latitude, longitude):
+        return int(math.floor(latitude / self.cell_degrees)), int(math.floor(longitude / self.cell_degrees))
+
+    def _ring(self, row, column, ring, visited):
+        """Points of the cells exactly ring cells away from (row, column), skipping visited cells."""
+        columns = int(round(360 / self.cell_degrees))
+        for r in range(max(row - ring, self.min_row), min(row + ring, self.max_row) + 1):
+            if ring == 0:
+                ring_columns = (column,)
+            elif abs(r - row) == ring:
+                ring_columns = range(column - ring, column + ring + 1)
+            else:
+                ring_columns = (column - ring, column + ring)
+
+            for c in ring_columns:
+                # longitudes wrap around the antimeridian, wide rings reach the same cells from both sides
+                cell = (r, (c + columns // 2) % columns - columns // 2)
+                if cell in visited:
+                    continue
+                visited.add(cell)
+                for point in self.cells.get(cell, ()):
+                    yield point
+
+    def _rest(self, visited):
+        for cell, points in self.cells.items():
+            if cell not in visited:
+                for point in points:
+                    yield point
+
+    def _ring_min_km(self, latitude, ring):
+        """Lower bound of the distance to the points ring or more cells away.
+
+        Such a point is at least (ring - 1) cells away in latitude or in longitude. For longitude the
+        bound is the distance to the nearest meridian that far away, asin(cos(latitude) * sin(delta)),
+        which holds whatever the latitude of the point, up to the poles (delta >= 90 goes over a pole).
+        """
+        delta = (ring - 1) * self.cell_degrees
+        latitude_km = delta * KM_PER_DEGREE
+        crossing = math.cos(math.radians(latitude)) * math.sin(math.radians(min(delta, 90.0)))
+        longitude_km = EARTH_RADIUS_KM * math.asin(min(1.0, crossing))
+        return min(latitude_km, longitude_km)
+
+    def nearest(self, latitude, longitude, k=5, radius_km=None, provider_id=None):
+        """Up to k (distance_km, point) pairs closest to the coordinates, nearest first."""
+        row, column = self._cell(latitude, longitude)
+        columns = int(round(360 / self.cell_degrees))
+        # past max_ring every cell has been visited
+        max_ring = max(abs(row - self.min_row), abs(row - self.max_row), columns // 2 + 1)
+        visited = set()
+        found = []
+
+        for ring in range(max_ring + 1):
+            if ring > 0:
+                bound = self._ring_min_km(latitude, ring)
+                if radius_km is not None and bound > radius_km:
+                    break
+                if len(found) >= k and bound > found[k - 1][0]:
+                    break
+
+            # once a ring has more cells than the index holds (sparse data, wide searches near the
+            # poles), the cells not visited yet are scanned directly and the walk ends
+            last = 8 * ring > len(self.cells)
+            points = self._rest(visited) if last else self._ring(row, column, ring, visited)
+
+            for point in points:
+                if provider_id is not None and point[1] != provider_id:
+                    continue
+                distance = haversine_km(latitude, longitude, point[3], point[4])
+                if radius_km is None or distance <= radius_km:
+                    found.append((distance, point))
+
+            found.sort(key=lambda pair: pair[0])
+            del found[k:]
+
+            if last or not self.points or len(self.points) == len(found):
+                break
+
+        return found
+
+    def distance_km(self, branch_id, latitude, longitude):
+        point = self.points.get(branch_id)
+        if point is None:
+            return None
+        return haversine_km(latitude, longitude, point[3], point[4])
+
+
+class BranchLocator(object):
+    """Per worker BranchIndex, rebuilt when the branches change.
+
+    Like the scenario catalog, the index is trusted for BRANCH_INDEX_TTL seconds and then a
+    count/max(geo_version) query tells whether it has to be rebuilt. geo_version only moves when
+    the columns of the index change, employee writes touch updated_at but keep the index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+        self._expires_at = 0
+
+    def index(self):
+        index = self._index
+        if index is not None and time.time() < self._expires_at:
+            return index
+
+        # queries outside the lock, see ScenarioCatalog._refresh
+        version = tuple(db.session.query(func.count(ProviderBranch.id), func.max(ProviderBranch.geo_version)).one())
+        if index is None or version != self._version:
+            points = db.session.query(ProviderBranch.id, ProviderBranch.provider_id, ProviderBranch.name,
+                                      ProviderBranch.latitude, ProviderBranch.longitude) \
+                               .filter(ProviderBranch.latitude.isnot(None)) \
+                               .filter(ProviderBranch.longitude.isnot(None))
+            index = BranchIndex([tuple(point) for point in points], current_app.config['BRANCH_INDEX_CELL_DEGREES'])
+            log.info('branch index built: %s branches' % len(index.points))
+
+        with self._lock:
+            self._index = index
+            self._version = version
+            self._expires_at = time.time() + current_app.config['BRANCH_INDEX_TTL']
+        return index
+
+    def invalidate(self):
+        self._expires_at = 0
+
+
+branch_locator = BranchLocator()
+
+
+@event.listens_for(ProviderBranch, 'after_insert')
+@event.listens_for(ProviderBranch, 'after_update')
+@event.listens_for(ProviderBranch, 'after_delete')
+def _branch_changed(mapper, connection, target):
+    branch_locator.invalidate()
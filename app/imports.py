@@ -0,0 +1,218 @@
+import csv
+import io
+import six
+import simplejson
+from flask import current_app
+from . import db
+from .models import ProviderBranchEmployee
+from .cache import invalidate_on_commit, provider_tags
+from .exceptions import ValidationError
+from .logger import log
+
+# request mimetypes of the import formats
+FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+
+STAGING = '''CREATE TEMPORARY TABLE employee_import (
+               line INTEGER NOT NULL,
+               provider_branch_id INTEGER NOT NULL,
+               name TEXT NOT NULL,
+               phone TEXT,
+               title TEXT
+             ) ON COMMIT DROP'''
+
+# staged rows whose branch exists (and belongs to the provider of the import, if any)
+MATCHED = '''FROM employee_import s
+             JOIN public.provider_branches b ON b.id = s.provider_branch_id
+              AND (%(provider_id)s IS NULL OR b.provider_id = %(provider_id)s)'''
+
+UNMATCHED = '''SELECT s.line, s.provider_branch_id, count(*) OVER ()
+               FROM employee_import s
+               WHERE NOT EXISTS (SELECT 1 FROM public.provider_branches b
+                                 WHERE b.id = s.provider_branch_id
+                                   AND (%(provider_id)s IS NULL OR b.provider_id = %(provider_id)s))
+               ORDER BY s.line
+               LIMIT %(limit)s'''
+
+INSERT = '''INSERT INTO training.provider_branch_employees (provider_branch_id, name, phone, title)
+            SELECT s.provider_branch_id, s.name, s.phone, s.title ''' + MATCHED + '''
+            ORDER BY s.line'''
+
+TOUCHED = '''SELECT DISTINCT b.id, p.slug ''' + MATCHED + '''
+             JOIN public.providers p ON p.id = b.provider_id'''
+
+
+def _csv_rows(lines):
+    # the python 2 csv module only reads bytes
+    if six.PY2:
+        reader = csv.reader(lines)
+        decode = lambda value: value.decode('utf-8')
+    else:
+        reader = csv.reader(line.decode('utf-8') for line in lines)
+        decode = lambda value: value
+
+    try:
+        header = [decode(name).strip().lstrip(u'\ufeff') for name in next(reader)]
+    except StopIteration:
+        return
+
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # NUL bytes (python 2) or a broken quoted field, the reader goes on with the next line
+            yield reader.line_num, None, 'not valid csv: %s' % e
+            continue
+
+        if not values:
+            continue
+        if len(values) != len(header):
+            yield reader.line_num, None, 'expected %s columns, got %s' % (len(header), len(values))
+            continue
+        # empty cells are missing values, as absent keys are in ndjson
+        yield reader.line_num, dict((name, decode(value) or None) for name, value in zip(header, values)), None
+
+
+def _ndjson_rows(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = simplejson.loads(line.decode('utf-8'))
+        except ValueError:
+            yield number, None, 'not valid json'
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'expected a json object'
+            continue
+        yield number, row, None
+
+
+def read_rows(lines, format):
+    """(line number, row dict, error) of every record of a csv or ndjson stream of byte lines."""
+    try:
+        if format == 'csv':
+            for record in _csv_rows(lines):
+                yield record
+        elif format == 'ndjson':
+            for record in _ndjson_rows(lines):
+                yield record
+        else:
+            raise ValidationError('format must be one of %s' % ', '.join(sorted(FORMATS.values())))
+    except UnicodeDecodeError:
+        raise ValidationError('the file must be utf-8 encoded')
+
+
+def _branch_id(row, default):
+    # csv turns empty cells into None, which falls back to the default as an absent key does
+    value = row.get('branch_id')
+    if value is None:
+        value = default
+    if value is None:
+        raise ValidationError('branch_id cannot be empty')
+    if isinstance(value, six.string_types) and value.strip().isdigit():
+        return int(value)
+    if isinstance(value, six.integer_types) and not isinstance(value, bool):
+        return value
+    raise ValidationError('branch_id %s is not valid' % value)
+
+
+def _text(value):
+    return None if value is None else six.text_type(value)
+
+
+def _copy_value(value):
+    if value is None:
+        return u'\\N'
+    return six.text_type(value).replace(u'\\', u'\\\\').replace(u'\t', u'\\t').replace(u'\n', u'\\n').replace(u'\r', u'\\r')
+
+
+def _green():
+    # psycopg2 refuses COPY once a wait callback is installed (gevent workers, see app/workers.py)
+    from psycopg2 import extensions
+    return extensions.get_wait_callback() is not None
+
+
+def _stage(cursor, rows):
+    if _green():
+        values = b','.join(cursor.mogrify('(%s, %s, %s, %s, %s)', row) for row in rows)
+        cursor.execute(b'INSERT INTO employee_import VALUES ' + values)
+        return
+
+    data = u''.join(u'\t'.join(_copy_value(value) for value in row) + u'\n' for row in rows)
+    cursor.copy_expert('COPY employee_import FROM STDIN', io.BytesIO(data.encode('utf-8')))
+
+
+def import_employees(lines, format, provider_id=None, branch_id=None):
+    """Bulk loads employees from a csv or ndjson stream of byte lines, one employee per record.
+
+    Records are validated one by one as they are read (ProviderBranchEmployee.validate, plus a
+    branch_id column unless branch_id gives the default) and COPYed in chunks of IMPORT_CHUNK_ROWS
+    into a temporary staging table, so the file is never held in memory. Branches are resolved
+    with one join against the whole staging table and the employees inserted by a single
+    INSERT ... SELECT. Invalid records are skipped and reported, the first IMPORT_MAX_ERRORS of
+    them by line. Nothing is committed here.
+    """
+    chunk_rows = current_app.config['IMPORT_CHUNK_ROWS']
+    max_errors = current_app.config['IMPORT_MAX_ERRORS']
+
+    # the connection of the session transaction, so the import commits or rolls back with it
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(STAGING)
+
+    errors = []
+    rejected = 0
+    chunk = []
+
+    for line, row, error in read_rows(lines, format):
+        if error is None:
+            try:
+                employee_branch_id = _branch_id(row, branch_id)
+                name, phone, title = ProviderBranchEmployee.validate(row)
+                chunk.append((line, employee_branch_id, _text(name), _text(phone), _text(title)))
+            except ValidationError as e:
+                error = e.args[0]
+
+        if error is not None:
+            rejected += 1
+            if len(errors) < max_errors:
+                errors.append({'line': line, 'message': error})
+
+        if len(chunk) >= chunk_rows:
+            _stage(cursor, chunk)
+            chunk = []
+
+    if chunk:
+        _stage(cursor, chunk)
+
+    cursor.execute('ANALYZE employee_import')
+
+    params = {'provider_id': provider_id, 'limit': max_errors}
+    cursor.execute(UNMATCHED, params)
+    unmatched = cursor.fetchall()
+    for line, unknown_branch_id, total in unmatched:
+        errors.append({'line': line, 'message': 'Branch %s does not exist' % unknown_branch_id})
+    if unmatched:
+        rejected += unmatched[0][2]
+
+    cursor.execute(INSERT, params)
+    imported = cursor.rowcount
+
+    cursor.execute(TOUCHED, params)
+    touched = cursor.fetchall()
+    cursor.close()
+
+    # the employees are not ORM instances, the cache tags are not collected on flush
+    if touched:
+        invalidate_on_commit(set('branch:%s' % touched_branch_id for touched_branch_id, slug in touched) |
+                             provider_tags(slug for touched_branch_id, slug in touched))
+
+    log.info('employees import: %s imported, %s rejected' % (imported, rejected))
+
+    return {
+        'imported': imported,
+        'rejected': rejected,
+        'errors': sorted(errors, key=lambda error: error['line'])[:max_errors]
+    }
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload, load_only
+from . import db, serializers
+from .models import TrainingSession, TrainingSessionAssistant, ScoreRollup
+
+
+def sessions_query(selection=serializers.ALL):
+    """Sessions loading the columns and the teacher only when the selection serializes them."""
+    query = TrainingSession.query
+    if selection.key != serializers.ALL.key:
+        query = query.options(load_only('id', *serializers.session.attributes(selection)))
+    if serializers.session.wants(selection, 'teacher'):
+        query = query.options(joinedload(TrainingSession.teacher))
+    return query
+
+
+def sessions_to_json(sessions, selection=serializers.ALL):
+    """Serializes sessions with their teacher, assistants, employees and average scores.
+
+    sessions should come from sessions_query() so teachers are joined in; the assistants and
+    the score rollups are then fetched for all the sessions at once instead of once per row.
+    Relations the selection leaves out are not queried at all, at most 3 queries are issued
+    whatever the number of sessions (tests/test_loaders.py).
+    """
+    sessions = list(sessions)
+    if not sessions:
+        return []
+
+    session_ids = [session.id for session in sessions]
+    context = {'averages': {}, 'assistants': defaultdict(list)}
+    scopes = []
+
+    if serializers.session.wants(selection, 'avg_score'):
+        scopes.append(and_(ScoreRollup.scope == ScoreRollup.SESSION, ScoreRollup.scope_id.in_(session_ids)))
+
+    if serializers.session.wants(selection, 'assistants'):
+        assistant_selection = selection.nested('assistants')
+        assistants = TrainingSessionAssistant.query.filter(TrainingSessionAssistant.training_session_id.in_(session_ids)) \
+                                                   .order_by(TrainingSessionAssistant.id)
+        if serializers.assistant.wants(assistant_selection, 'employee'):
+            assistants = assistants.options(joinedload(TrainingSessionAssistant.employee))
+
+        for assistant in assistants:
+            context['assistants'][assistant.training_session_id].append(assistant)
+
+        assistant_ids = [assistant.id for session_assistants in context['assistants'].values() for assistant in session_assistants]
+        if assistant_ids and serializers.assistant.wants(assistant_selection, 'score'):
+            scopes.append(and_(ScoreRollup.scope == ScoreRollup.ASSISTANT, ScoreRollup.scope_id.in_(assistant_ids)))
+
+    # session and assistant averages come from their rollups in one query
+    if scopes:
+        rollups = db.session.query(ScoreRollup.scope, ScoreRollup.scope_id, ScoreRollup.score_sum / ScoreRollup.score_count) \
+                            .filter(or_(*scopes))
+        context['averages'] = dict(((scope, scope_id), average) for scope, scope_id, average in rollups)
+
+    return serializers.session.many(sessions, context, selection)
+
+
+def session_to_json(session_id, selection=serializers.ALL):
+    sessions = sessions_to_json(sessions_query(selection).filter(TrainingSession.id == session_id), selection)
+    return sessions[0] if sessions else None
+
+
+def freeze_session(session):
+    """Stores the rendered json of a finished session, nothing can be added to it anymore."""
+    # pending changes of the session are written before its rows are read back
+    db.session.flush()
+    session.serialized_json = serializers.dumps(session_to_json(session.id))
+
+
+def backfill_sessions_json(force=False, chunk_size=100):
+    """Renders the json of finished sessions that don't have it (or all of them with force)."""
+    finished = TrainingSession.status == TrainingSession.FINISHED
+    if not force:
+        finished = finished & TrainingSession.serialized_json.is_(None)
+
+    rendered = 0
+    last_id = 0
+    while True:
+        sessions = sessions_query().filter(finished).filter(TrainingSession.id > last_id) \
+                                   .order_by(TrainingSession.id).limit(chunk_size).all()
+        if not sessions:
+            return rendered
+
+        for session, content in zip(sessions, sessions_to_json(sessions)):
+            session.serialized_json = serializers.dumps(content)
+
+        last_id = sessions[-1].id
+        rendered += len(sessions)
+        db.session.commit()
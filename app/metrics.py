@@ -0,0 +1,277 @@
+import atexit
+import errno
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from .logger import log
+
+# histogram upper bounds in seconds, the last bucket takes everything above
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# counts of the workers that exited, folded in by report() and by a new worker reusing a pid
+RETIRED = 'retired.json'
+LOCK = 'lock'
+
+
+def _histogram():
+    return {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0}
+
+
+def _observe(histogram, seconds):
+    histogram['buckets'][bisect_left(BUCKETS, seconds)] += 1
+    histogram['sum'] += seconds
+
+
+def _merge_histogram(total, histogram):
+    total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+    total['sum'] += histogram['sum']
+
+
+def _state(started_at):
+    return {'started_at': started_at, 'requests': {}, 'uploads': {'count': 0, 'failures': 0, 'latency': _histogram()}}
+
+
+def _merge_state(total, state):
+    """Adds the counters of a process state to total."""
+    if total['started_at'] is None or state['started_at'] < total['started_at']:
+        total['started_at'] = state['started_at']
+
+    for route, metrics in state['requests'].items():
+        routes = total['requests']
+        merged = routes.setdefault(route, {'count': 0, 'status': {}, 'queries': 0, 'latency': _histogram(), 'db': _histogram()})
+        merged['count'] += metrics['count']
+        merged['queries'] += metrics['queries']
+        for status, count in metrics['status'].items():
+            merged['status'][status] = merged['status'].get(status, 0) + count
+        _merge_histogram(merged['latency'], metrics['latency'])
+        _merge_histogram(merged['db'], metrics['db'])
+
+    uploads = total['uploads']
+    uploads['count'] += state['uploads']['count']
+    uploads['failures'] += state['uploads']['failures']
+    _merge_histogram(uploads['latency'], state['uploads']['latency'])
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        # gone, or replaced while reading: it is picked up on the next report
+        return None
+
+
+def _write(directory, name, state):
+    # atomically, so readers never see half a file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(json.dumps(state))
+    os.rename(tmp_path, os.path.join(directory, name))
+
+
+def _quantile(buckets, q):
+    """Estimates a quantile from bucket counts, interpolating linearly inside the bucket."""
+    count = sum(buckets)
+    if not count:
+        return None
+
+    rank = q * count
+    seen = 0
+    for i, bucket in enumerate(buckets):
+        if seen + bucket >= rank and bucket:
+            if i == len(BUCKETS):
+                return BUCKETS[-1]
+            lower = BUCKETS[i - 1] if i else 0.0
+            return lower + (BUCKETS[i] - lower) * (rank - seen) / bucket
+        seen += bucket
+    return BUCKETS[-1]
+
+
+def _summary(histogram, count):
+    summary = {'mean': histogram['sum'] * 1000 / count if count else None}
+    for q in QUANTILES:
+        value = _quantile(histogram['buckets'], q)
+        summary['p%d' % round(q * 100)] = value * 1000 if value is not None else None
+    return summary
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class Metrics(object):
+    """Request and upload metrics aggregated across the gunicorn workers of the host.
+
+    Recording only updates counters in memory. A thread per worker process writes them to
+    METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds, and report() merges the files
+    of every process, so /metrics adds up all the workers whichever one answers. The file of a
+    process that is gone (gunicorn recycled the worker, or its pid was reused) is folded into
+    METRICS_DIR/retired.json, under a lock file, so the totals never go backwards.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._state = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['metrics'] = self
+
+    def _current(self):
+        # counters and the flusher thread do not survive gunicorn's fork, each worker starts its own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._state = _state(time.time())
+            flusher = threading.Thread(target=self._flush_periodically, name='metrics-flusher')
+            flusher.daemon = True
+            flusher.start()
+            atexit.register(self.flush)
+        return self._state
+
+    def observe_request(self, route, status, seconds, db_seconds, queries):
+        with self._lock:
+            routes = self._current()['requests']
+            metrics = routes.get(route)
+            if metrics is None:
+                metrics = routes[route] = {'count': 0, 'status': {}, 'queries': 0, 'latency': _histogram(), 'db': _histogram()}
+
+            metrics['count'] += 1
+            metrics['status'][status] = metrics['status'].get(status, 0) + 1
+            metrics['queries'] += queries
+            _observe(metrics['latency'], seconds)
+            _observe(metrics['db'], db_seconds)
+
+    def observe_upload(self, seconds, ok):
+        with self._lock:
+            uploads = self._current()['uploads']
+            uploads['count'] += 1
+            if not ok:
+                uploads['failures'] += 1
+            _observe(uploads['latency'], seconds)
+
+    def _directory(self):
+        return self.app.config['METRICS_DIR']
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.app.config['METRICS_FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception:
+                log.exception('metrics flush failed')
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock of METRICS_DIR between the processes, held while files are retired."""
+        directory = self._directory()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(os.path.join(directory, LOCK), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield directory
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _retire(self, directory, states):
+        # with the lock held: the dead processes' counters go to RETIRED before their files are removed
+        retired = _read(os.path.join(directory, RETIRED)) or _state(None)
+        for state in states:
+            _merge_state(retired, state)
+        _write(directory, RETIRED, retired)
+
+    def flush(self):
+        """Writes the counters of this process, atomically so readers never see half a file."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            state = json.loads(json.dumps(self._state))
+
+        name = '%s.json' % os.getpid()
+        with self._locked() as directory:
+            # a file of this pid written by another process is from a worker that exited
+            previous = _read(os.path.join(directory, name))
+            if previous is not None and previous['started_at'] != state['started_at']:
+                self._retire(directory, [previous])
+            _write(directory, name, state)
+
+    def clear(self):
+        """Removes the files of previous runs, gunicorn calls it before forking the workers."""
+        directory = self._directory()
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+
+    def _processes(self):
+        """States of the processes alive, after the files of the others are retired."""
+        with self._locked() as directory:
+            states = []
+            dead = []
+            for name in os.listdir(directory):
+                if not name.endswith('.json') or name == RETIRED:
+                    continue
+                state = _read(os.path.join(directory, name))
+                if state is None:
+                    continue
+                if _alive(int(name[:-len('.json')])):
+                    states.append(state)
+                else:
+                    dead.append((name, state))
+
+            if dead:
+                self._retire(directory, [state for name, state in dead])
+                for name, state in dead:
+                    os.remove(os.path.join(directory, name))
+
+            return states, _read(os.path.join(directory, RETIRED))
+
+    def report(self):
+        self.flush()
+
+        states, retired = self._processes()
+        total = _state(None)
+        for state in states + ([retired] if retired is not None else []):
+            _merge_state(total, state)
+
+        processes = len(states)
+        started_at = total['started_at']
+        routes = total['requests']
+        uploads = total['uploads']
+
+        return {
+            'processes': processes,
+            'since': started_at,
+            'buckets_ms': [bound * 1000 for bound in BUCKETS],
+            'routes': [{
+                'route': route,
+                'count': metrics['count'],
+                'status': metrics['status'],
+                'queries_mean': float(metrics['queries']) / metrics['count'],
+                'latency_ms': dict(_summary(metrics['latency'], metrics['count']), histogram=metrics['latency']['buckets']),
+                'db_ms': _summary(metrics['db'], metrics['count'])
+            } for route, metrics in sorted(routes.items())],
+            'storage_uploads': {
+                'count': uploads['count'],
+                'failures': uploads['failures'],
+                'latency_ms': dict(_summary(uploads['latency'], uploads['count']), histogram=uploads['latency']['buckets'])
+            }
+        }
+
+
+metrics = Metrics()
@@ -0,0 +1,90 @@
+import os
+import re
+from . import db
+from .logger import log
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db')
+MIGRATION_FILE = re.compile(r'^v(\d+)_(\w+)\.sql$')
+
+CREATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS public.schema_migrations (
+  version INTEGER PRIMARY KEY,
+  name VARCHAR NOT NULL,
+  applied_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+)
+'''
+
+
+def available():
+    """(version, name, path) of the db/vN_name.sql scripts, by version."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+
+def _execute(*statements):
+    """Runs (sql, params) statements in one transaction, returns the rows of the last one.
+
+    Scripts go straight to psycopg2: SQLAlchemy's text() would take their casts for bind params,
+    and without params psycopg2 leaves the % of format() strings alone.
+    """
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for sql, params in statements:
+            cursor.execute(sql, params)
+        rows = cursor.fetchall() if cursor.description else None
+        connection.commit()
+        return rows
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def _record(version, name):
+    return ('INSERT INTO public.schema_migrations (version, name) VALUES (%(version)s, %(name)s)', {'version': version, 'name': name})
+
+
+def applied():
+    rows = _execute((CREATE_TABLE, None), ('SELECT version FROM public.schema_migrations', None))
+    return set(version for version, in rows)
+
+
+def status():
+    done = applied()
+    return [(version, name, version in done) for version, name, path in available()]
+
+
+def upgrade(target=None):
+    """Runs the pending scripts up to target, each one in its own transaction with its bookkeeping."""
+    done = applied()
+    ran = []
+
+    for version, name, path in available():
+        if version in done or (target is not None and version > target):
+            continue
+
+        with open(path) as f:
+            script = f.read()
+
+        log.info('applying migration v%s %s' % (version, name))
+        _execute((script, None), _record(version, name))
+        ran.append((version, name))
+
+    return ran
+
+
+def baseline(target):
+    """Marks the scripts up to target as applied without running them (databases created by hand)."""
+    done = applied()
+    marked = []
+    for version, name, path in available():
+        if version <= target and version not in done:
+            _execute(_record(version, name))
+            marked.append((version, name))
+    return marked
@@ -1,3 +1,5 @@
+import six
+from flask import current_app
 from app import db
 from app.exceptions import ValidationError
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -14,16 +16,13 @@ class Provider(AuditMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     slug = db.Column(db.String)
+    # maintained by the counter_cache trigger (db/v2_counter_caches.sql)
+    branches_count = db.Column(db.Integer, nullable=False, server_default='0')
     branches = db.relationship('ProviderBranch', backref='provider', lazy='dynamic')
 
     def to_json(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'slug': self.slug,
-            'branches': [branch.to_json() for branch in self.branches],
-            'branches_count': self.branches.count()
-        }
+        from . import serializers
+        return serializers.provider.serialize(self)
 
     def __repr__(self):
         return '<Provider %s>' % (self.name)
@@ -36,17 +35,16 @@ class ProviderBranch(AuditMixin, db.Model):
     name = db.Column(db.String)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    # maintained by the counter_cache trigger (db/v2_counter_caches.sql)
+    employees_count = db.Column(db.Integer, nullable=False, server_default='0')
+    # moved by the branch_geo_version trigger when the columns of the branch index change (db/v13_branch_geo_version.sql)
+    geo_version = db.Column(db.BigInteger, nullable=False, server_default=db.FetchedValue())
 
     employees = db.relationship('ProviderBranchEmployee', backref='branch', lazy='dynamic')
 
     def to_json(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'latitude': self.latitude,
-            'longitude': self.longitude,
-            'employees': self.employees.count()
-        }
+        from . import serializers
+        return serializers.branch.serialize(self)
 
     def __repr__(self):
         return '<ProviderBranch %s>' % self.name
@@ -62,18 +60,15 @@ class ProviderBranchEmployee(AuditMixin, db.Model):
     title = db.Column(db.String)
 
     def to_json(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'phone': self.phone,
-            'title': self.title
-        }
+        from . import serializers
+        return serializers.employee.serialize(self)
 
     def __repr__(self):
         return '<ProviderBranchEmployee %s>' % (self.name)
 
     @staticmethod
-    def from_json(json):
+    def validate(json):
+        """(name, phone, title) of an employee document, shared by from_json and the bulk import."""
         name = json.get('name')
         phone = json.get('phone')
         title = json.get('title')
@@ -81,6 +76,21 @@ class ProviderBranchEmployee(AuditMixin, db.Model):
         if name is None or name == '':
             raise ValidationError('Name cannot be empty')
 
+        # the varchar lengths of db/v1_initial_script.sql, a bulk import rejects the row instead of failing the insert
+        for field, value, max_length in (('name', name, 150), ('phone', phone, 50), ('title', title, 50)):
+            if value is None:
+                continue
+            value = six.text_type(value)
+            if len(value) > max_length:
+                raise ValidationError('%s cannot be longer than %s characters' % (field, max_length))
+            if u'\x00' in value:
+                raise ValidationError('%s cannot contain NUL characters' % field)
+
+        return name, phone, title
+
+    @staticmethod
+    def from_json(json):
+        name, phone, title = ProviderBranchEmployee.validate(json)
         return ProviderBranchEmployee(name=name, phone=phone, title=title)
 
 
@@ -91,11 +101,8 @@ class User(AuditMixin, db.Model):
     last_name = db.Column(db.String)
 
     def to_json(self):
-        return {
-            'id': self.id,
-            'first_name': self.first_name,
-            'last_name': self.last_name
-        }
+        from . import serializers
+        return serializers.user.serialize(self)
 
     def __repr__(self):
         return '<User %s %s>' % (self.first_name, self.last_name)
@@ -108,10 +115,8 @@ class TrainingScenario(AuditMixin, db.Model):
     description = db.Column(db.String)
 
     def to_json(self):
-        return {
-            'id': self.id,
-            'description': self.description
-        }
+        from . import serializers
+        return serializers.scenario.serialize(self)
 
     def __repr__(self):
         return '<TrainingScenario %s >' % self.description
@@ -122,16 +127,15 @@ class TrainingBatch (AuditMixin, db.Model):
     __table_args__ = {'schema': 'training'}
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
+    # maintained by the counter_cache trigger (db/v2_counter_caches.sql)
+    sessions_count = db.Column(db.Integer, nullable=False, server_default='0')
 
     # relationships
     sessions = db.relationship('TrainingSession', backref='batch', lazy='dynamic')
 
     def to_json(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'sessions': self.sessions.count()
-        }
+        from . import serializers
+        return serializers.batch.serialize(self)
 
     @staticmethod
     def from_json(json):
@@ -159,34 +163,38 @@ class TrainingSession(AuditMixin, db.Model):
     longitude = db.Column(db.Float)
     comments = db.Column(db.String(512))
     signature_url = db.Column(db.String)
+    signature_sha256 = db.Column(db.String(64))
 
-    # computed properties
-    # @aggregated('assistants', db.Column(db.Integer))
-    # def avg_score(self):
-    #     return func.avg(TrainingSessionAssistant.score)
+    # distance to the branch coordinates when the session was created, see app/geo.py
+    branch_distance_km = db.Column(db.Float)
+    location_flagged = db.Column(db.Boolean, nullable=False, default=False, server_default='false')
+
+    # signature upload pipeline, see app/uploads.py
+    OPEN = 'open'
+    FINISHING = 'finishing'
+    FINISHED = 'finished'
+    UPLOAD_FAILED = 'upload_failed'
+    status = db.Column(db.String(20), nullable=False, default=OPEN, server_default=OPEN)
+    upload_attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
-    # @hybrid_property
-    # def avg_score(self):
-    #     # return func.avg(TrainingSessionAssistant.score)
-    #     return db.session.query(func.avg(TrainingSessionAssistant.score)).filter(TrainingSessionAssistant.training_session_id == self.id).scalar()
+    # rendered once the session is finished, see loaders.freeze_session
+    serialized_json = db.deferred(db.Column(db.Text))
+
+    # computed properties
+    @property
+    def avg_score(self):
+        return ScoreRollup.averages(ScoreRollup.SESSION, [self.id]).get((ScoreRollup.SESSION, self.id))
 
     # relations
     teacher = db.relationship('User', backref='training_sessions')
     provider_branch = db.relationship('ProviderBranch', backref='training_sessions')
     assistants = db.relationship('TrainingSessionAssistant', backref='session', lazy='dynamic')
 
-    def to_json(self):
-        return {
-            'id': self.id,
-            'teacher_id': self.teacher_id,
-            'latitude': self.latitude,
-            'longitude': self.longitude,
-            'comments': self.comments,
-            'signature_url': self.signature_url,
-            'teacher': self.teacher.to_json(),
-            # 'avg_score': self.avg_score,
-            'assistants': [assistant.to_json() for assistant in self.assistants]
-        }
+    def to_json(self, assistants=None, averages=None):
+        # assistant models and averages can be handed in by the batch loader (see app/loaders.py)
+        from . import serializers
+        return serializers.session.serialize(self, {'assistants': {self.id: assistants} if assistants is not None else None,
+                                                    'averages': averages})
 
     @staticmethod
     def from_json(json):
@@ -207,7 +215,21 @@ class TrainingSession(AuditMixin, db.Model):
         if longitude is None:
             raise ValidationError('longitude cannot be empty')
 
-        return TrainingSession(provider_branch_id=provider_branch_id, teacher_id=teacher_id, latitude=latitude, longitude=longitude)
+        session = TrainingSession(provider_branch_id=provider_branch_id, teacher_id=teacher_id, latitude=latitude, longitude=longitude)
+        session.check_location()
+        return session
+
+    def check_location(self):
+        """Flags the session when it is implausibly far from its branch."""
+        from .geo import branch_locator
+
+        try:
+            distance = branch_locator.index().distance_km(int(self.provider_branch_id), float(self.latitude), float(self.longitude))
+        except (TypeError, ValueError):
+            return
+
+        self.branch_distance_km = distance
+        self.location_flagged = distance is not None and distance > current_app.config['SESSION_MAX_BRANCH_DISTANCE_KM']
 
     def __repr__(self):
         return '<TrainingSession %s %s >' % (self.teacher.first_name, self.teacher.last_name)
@@ -226,18 +248,14 @@ class TrainingSessionAssistant(AuditMixin, db.Model):
 
     scores = db.relationship('TrainingSessionAssistantScore', backref='training_session_assistant', lazy='dynamic')
 
-    @hybrid_property
+    @property
     def avg_score(self):
-        return db.session.query(func.avg(TrainingSessionAssistantScore.score)).filter(TrainingSessionAssistantScore.training_session_assistant_id == self.id).scalar()
+        return ScoreRollup.averages(ScoreRollup.ASSISTANT, [self.id]).get((ScoreRollup.ASSISTANT, self.id))
 
-    def to_json(self):
-        return {
-            'id': self.id,
-            'training_session_id': self.training_session_id,
-            'provider_branch_employee_id': self.provider_branch_employee_id,
-            'employee': self.employee.to_json(),
-            'score': self.avg_score
-        }
+    def to_json(self, averages=None):
+        # averages comes from ScoreRollup.averages when the loader serializes many assistants at once
+        from . import serializers
+        return serializers.assistant.serialize(self, {'averages': averages})
 
     def __repr__(self):
         return '<TrainingSessionAssistant %s %s>' % self.employee.name
@@ -255,12 +273,57 @@ class TrainingSessionAssistantScore(AuditMixin, db.Model):
     scenario = db.relationship('TrainingScenario')
 
     def to_json(self):
-        return {
-            'id': self.id,
-            'training_session_assistant_id': self.training_session_id,
-            'scenario': self.scenario.to_json(),
-            'score': self.score
-        }
+        from . import serializers
+        return serializers.score.serialize(self)
 
     def __repr__(self):
         return '<TrainingSessionAssistant %s %s>' % self.employee.name
+
+
+
+class SyncReceipt(AuditMixin, db.Model):
+    """Idempotency key of a session submitted through the offline sync, see app/sync.py."""
+    __tablename__ = 'sync_receipts'
+    __table_args__ = {'schema': 'training'}
+
+    idempotency_key = db.Column(db.String(64), primary_key=True)
+    training_session_id = db.Column(db.Integer, db.ForeignKey(TrainingSession.id), nullable=False)
+
+    def __repr__(self):
+        return '<SyncReceipt %s %s>' % (self.idempotency_key, self.training_session_id)
+
+
+class ScoreRollup(AuditMixin, db.Model):
+    __tablename__ = 'score_rollups'
+    __table_args__ = {'schema': 'training'}
+
+    ASSISTANT = 'assistant'
+    SESSION = 'session'
+    BATCH = 'batch'
+    SCENARIO = 'scenario'
+
+    scope = db.Column(db.String(20), primary_key=True)
+    scope_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    score_sum = db.Column(db.Numeric, nullable=False)
+    score_count = db.Column(db.Integer, nullable=False)
+    score_min = db.Column(db.Numeric, nullable=False)
+    score_max = db.Column(db.Numeric, nullable=False)
+
+    @staticmethod
+    def averages(scope, ids):
+        """{(scope, id): average score} for the given ids of one scope, in a single query."""
+        ids = list(ids)
+        if not ids:
+            return {}
+
+        rollups = db.session.query(ScoreRollup.scope, ScoreRollup.scope_id, ScoreRollup.score_sum / ScoreRollup.score_count) \
+                            .filter(ScoreRollup.scope == scope) \
+                            .filter(ScoreRollup.scope_id.in_(ids))
+        return dict(((scope, scope_id), average) for scope, scope_id, average in rollups)
+
+    def to_json(self):
+        from . import serializers
+        return serializers.rollup.serialize(self)
+
+    def __repr__(self):
+        return '<ScoreRollup %s %s>' % (self.scope, self.scope_id)
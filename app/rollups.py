@@ -0,0 +1,77 @@
+from sqlalchemy import text
+from . import db
+from .models import ScoreRollup
+
+UPSERT = '''
+INSERT INTO training.score_rollups (scope, scope_id, score_sum, score_count, score_min, score_max)
+VALUES %s
+ON CONFLICT (scope, scope_id) DO UPDATE SET
+  score_sum = score_rollups.score_sum + excluded.score_sum,
+  score_count = score_rollups.score_count + excluded.score_count,
+  score_min = least(score_rollups.score_min, excluded.score_min),
+  score_max = greatest(score_rollups.score_max, excluded.score_max),
+  updated_at = now()
+'''
+
+REBUILD = '''
+INSERT INTO training.score_rollups (scope, scope_id, score_sum, score_count, score_min, score_max)
+SELECT :scope, {column}, sum(sc.score), count(*), min(sc.score), max(sc.score)
+FROM training.training_session_assistant_scores sc
+JOIN training.training_session_assistants a ON a.id = sc.training_session_assistant_id
+JOIN training.training_sessions s ON s.id = a.training_session_id
+GROUP BY {column}
+'''
+
+# rollup scope -> column of the REBUILD join it groups by
+SCOPE_COLUMNS = (
+    (ScoreRollup.ASSISTANT, 'a.id'),
+    (ScoreRollup.SESSION, 's.id'),
+    (ScoreRollup.BATCH, 's.training_batch_id'),
+    (ScoreRollup.SCENARIO, 'sc.training_scenario_id'),
+)
+
+
+def apply_scores(session, scores):
+    """Adds freshly inserted scores to the rollups of their assistant, session, batch and scenario.
+
+    scores are dicts with training_session_assistant_id, training_scenario_id and score. The
+    deltas are aggregated in memory and applied with a single multi-row upsert, in a stable
+    order so concurrent requests lock the shared batch/scenario rows the same way.
+    """
+    deltas = {}
+    for score in scores:
+        keys = ((ScoreRollup.ASSISTANT, score['training_session_assistant_id']),
+                (ScoreRollup.SESSION, session.id),
+                (ScoreRollup.BATCH, session.training_batch_id),
+                (ScoreRollup.SCENARIO, score['training_scenario_id']))
+
+        for key in keys:
+            delta = deltas.get(key)
+            if delta is None:
+                deltas[key] = [score['score'], 1, score['score'], score['score']]
+            else:
+                delta[0] += score['score']
+                delta[1] += 1
+                delta[2] = min(delta[2], score['score'])
+                delta[3] = max(delta[3], score['score'])
+
+    if not deltas:
+        return
+
+    values = []
+    params = {}
+    for i, ((scope, scope_id), (score_sum, score_count, score_min, score_max)) in enumerate(sorted(deltas.items())):
+        values.append('(:scope_%(i)s, :id_%(i)s, :sum_%(i)s, :count_%(i)s, :min_%(i)s, :max_%(i)s)' % {'i': i})
+        params.update({'scope_%s' % i: scope, 'id_%s' % i: scope_id, 'sum_%s' % i: score_sum,
+                       'count_%s' % i: score_count, 'min_%s' % i: score_min, 'max_%s' % i: score_max})
+
+    db.session.execute(text(UPSERT % ', '.join(values)), params)
+
+
+def rebuild():
+    """Recomputes every rollup from training_session_assistant_scores in one transaction."""
+    db.session.execute(ScoreRollup.__table__.delete())
+    for scope, column in SCOPE_COLUMNS:
+        db.session.execute(text(REBUILD.format(column=column)), {'scope': scope})
+    db.session.commit()
+    return db.session.query(ScoreRollup.scope, db.func.count()).group_by(ScoreRollup.scope).all()
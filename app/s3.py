@@ -1,3 +1,9 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
 import boto
 from flask import current_app
 from boto.s3.key import Key
@@ -5,17 +11,190 @@ from .logger import log
 import boto.s3.connection
 
 
-def upload_to_s3(file, filename, url_expires_in=0, url_query_auth=False, url_force_http=False):
-    boto.set_stream_logger('boto')
-    conn = boto.connect_s3(current_app.config['AWS_ACCESS_KEY'], current_app.config['AWS_SECRET_KEY'])
-    bucket = conn.get_bucket(current_app.config['AWS_BUCKET_NAME'])
+_lock = threading.Lock()
+_bucket = None
+_bucket_pid = None
+_stream_logger = False
 
-    k = Key(bucket)
-    k.key = filename
-    k.set_metadata('Content-Type', 'image/jpeg')
-    k.set_contents_from_string(file)
-    # k.set_acl('public-read')
-    k.make_public()
-    log.info('uploaded file %s to bucket %s' % (filename, bucket))
-    return k.generate_url(url_expires_in, query_auth=url_query_auth, force_http=url_force_http)
 
+def get_bucket():
+    """Bucket handle shared by the whole worker process.
+
+    The connection is created once per process (gunicorn forks after the app is loaded) so its
+    keep-alive HTTP connections are reused across uploads, and the bucket is not validated,
+    which would cost an extra request.
+    """
+    global _bucket, _bucket_pid, _stream_logger
+
+    with _lock:
+        if _bucket is not None and _bucket_pid == os.getpid():
+            return _bucket
+
+        if current_app.debug and not _stream_logger:
+            boto.set_stream_logger('boto')
+            _stream_logger = True
+
+        options = {}
+        if current_app.config['AWS_S3_HOST']:
+            # S3 compatible endpoints (minio, local stand-ins)
+            options = {'host': current_app.config['AWS_S3_HOST'],
+                       'port': current_app.config['AWS_S3_PORT'],
+                       'is_secure': current_app.config['AWS_S3_SECURE'],
+                       'calling_format': boto.s3.connection.OrdinaryCallingFormat()}
+
+        conn = boto.connect_s3(current_app.config['AWS_ACCESS_KEY'], current_app.config['AWS_SECRET_KEY'], **options)
+        _bucket = conn.get_bucket(current_app.config['AWS_BUCKET_NAME'], validate=False)
+        _bucket_pid = os.getpid()
+        return _bucket
+
+
+# (magic bytes, content type, extension) of the signature formats we know about
+CONTENT_TYPES = (
+    (b'\xff\xd8\xff', 'image/jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', '.png'),
+)
+
+
+def sniff_content_type(path):
+    with open(path, 'rb') as f:
+        head = f.read(8)
+
+    for magic, content_type, extension in CONTENT_TYPES:
+        if head.startswith(magic):
+            return content_type, extension
+
+    return 'application/octet-stream', ''
+
+
+def file_sha256(path, chunk_size=64 * 1024):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class S3Storage(object):
+    """Objects in AWS_BUCKET_NAME, public-read, through the per process bucket handle."""
+
+    def __init__(self, part_size, max_known_keys=10000):
+        self.part_size = part_size
+        # the last keys this process uploaded, a HEAD per upload would cost as much as the PUT it
+        # saves. Bounded: older duplicates are caught by the sha256 lookup of the uploader anyway
+        self.max_known_keys = max_known_keys
+        self._known_keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def exists(self, key):
+        with self._lock:
+            return key in self._known_keys
+
+    def _remember(self, key):
+        with self._lock:
+            self._known_keys.pop(key, None)
+            self._known_keys[key] = True
+            while len(self._known_keys) > self.max_known_keys:
+                self._known_keys.popitem(last=False)
+
+    def put(self, path, key, content_type):
+        bucket = get_bucket()
+        headers = {'Content-Type': content_type}
+
+        if os.path.getsize(path) > self.part_size:
+            self._multipart_upload(bucket, path, key, headers)
+        else:
+            k = Key(bucket)
+            k.key = key
+            # the canned ACL travels with the PUT, make_public() would be a second request
+            k.set_contents_from_filename(path, headers=headers, policy='public-read')
+
+        self._remember(key)
+        log.info('uploaded file %s to bucket %s' % (key, bucket))
+
+    def _multipart_upload(self, bucket, path, key, headers):
+        """Sends a large file in part_size pieces so it is never held in memory as a whole."""
+        size = os.path.getsize(path)
+        upload = bucket.initiate_multipart_upload(key, headers=headers, policy='public-read')
+        try:
+            with open(path, 'rb') as f:
+                for part, offset in enumerate(range(0, size, self.part_size), 1):
+                    f.seek(offset)
+                    upload.upload_part_from_file(f, part, size=min(self.part_size, size - offset))
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
+
+    def url(self, key):
+        return Key(get_bucket(), key).generate_url(0, query_auth=False, force_http=False)
+
+
+class LocalStorage(object):
+    """Objects under a local directory (tests, on-prem deployments), no network involved."""
+
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, path, key, content_type):
+        target = self._path(key)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+
+        # copy next to the target and rename, readers never see a partial object
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out, open(path, 'rb') as f:
+                shutil.copyfileobj(f, out)
+            os.rename(tmp_path, target)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        log.info('copied file %s to %s' % (key, target))
+
+    def url(self, key):
+        return self.base_url + '/' + key
+
+
+_storages = {}
+
+
+def get_storage():
+    """Storage backend selected by SIGNATURE_STORAGE: 's3' or 'local'."""
+    name = current_app.config['SIGNATURE_STORAGE']
+
+    if name not in _storages:
+        if name == 'local':
+            _storages[name] = LocalStorage(current_app.config['LOCAL_STORAGE_DIR'], current_app.config['LOCAL_STORAGE_URL'])
+        elif name == 's3':
+            _storages[name] = S3Storage(current_app.config['AWS_S3_MULTIPART_THRESHOLD'])
+        else:
+            raise ValueError('unknown SIGNATURE_STORAGE %s' % name)
+
+    return _storages[name]
+
+
+def store_file(path, checksum=None, prefix='training/signatures/'):
+    """Stores a file under a key derived from its content and returns its url.
+
+    Identical content always maps to the same key, so storing it again is a no-op when the
+    backend already knows the object, and at worst rewrites the same bytes.
+    """
+    if checksum is None:
+        checksum = file_sha256(path)
+
+    content_type, extension = sniff_content_type(path)
+    key = prefix + checksum + extension
+
+    storage = get_storage()
+    if not storage.exists(key):
+        storage.put(path, key, content_type)
+
+    return storage.url(key)
@@ -0,0 +1,97 @@
+import six
+from collections import defaultdict
+from . import db
+from .models import ProviderBranchEmployee, TrainingSessionAssistant, TrainingSessionAssistantScore
+from .catalog import scenario_catalog
+from .rollups import apply_scores
+from .cache import invalidate_on_commit
+from .exceptions import ValidationError
+from .logger import log
+
+
+def _as_id(value):
+    # ids used to be compared in SQL, so numeric strings keep being accepted
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, six.integer_types):
+        return value
+    if isinstance(value, six.string_types) and value.isdigit():
+        return int(value)
+    return None
+
+
+def _ids(values):
+    return set(_as_id(value) for value in values) - set([None])
+
+
+def add_session_assistants(session, assistants):
+    """Validates the assistants payload of a session and inserts assistants and scores in bulk.
+
+    Employees are resolved with one IN query and scenarios by the catalog, the whole payload is validated
+    in memory before anything is written and rows are inserted with multi-row INSERTs, so the
+    number of statements does not depend on the payload size. Nothing is committed here.
+    """
+    employee_ids = _ids(assistant.get('employee_id') for assistant in assistants)
+    scenario_ids = _ids(result.get('scenario_id') for assistant in assistants for result in assistant.get('results') or [])
+
+    employees = {}
+    if employee_ids:
+        employees = dict(db.session.query(ProviderBranchEmployee.id, ProviderBranchEmployee.name)
+                                   .filter(ProviderBranchEmployee.provider_branch_id == session.provider_branch_id)
+                                   .filter(ProviderBranchEmployee.id.in_(employee_ids)))
+
+    scenarios = scenario_catalog.existing(scenario_ids)
+
+    for assistant in assistants:
+
+        if _as_id(assistant['employee_id']) not in employees:
+            raise ValidationError('Employee %s does not exist' % assistant['employee_id'])
+
+        if assistant['results'] is None:
+            raise ValidationError('scores array on assistant #%s' % assistant['employee_id'])
+
+        for x, result in enumerate(assistant['results']):
+
+            if result['scenario_id'] is None:
+                raise ValidationError('scenario_id is null in result [%s] of assistant #%s' % (x + 1, assistant['employee_id']))
+
+            if _as_id(result['scenario_id']) not in scenarios:
+                raise ValidationError('scenario in result [%s] of assistant #%s does not exist' % (x + 1, assistant['employee_id']))
+
+            if result['score'] is None:
+                raise ValidationError('score in result [%s] of assistant #%s is null' % (x + 1, assistant['employee_id']))
+
+            if result['score'] < 0 or result['score'] > 100:
+                raise ValidationError('score in result [%s] of assistant #%s is outside of permitted scope [0-100]' % (x + 1, assistant['employee_id']))
+
+    if not assistants:
+        return []
+
+    assistant_table = TrainingSessionAssistant.__table__
+    score_table = TrainingSessionAssistantScore.__table__
+
+    rows = [{'training_session_id': session.id, 'provider_branch_employee_id': _as_id(assistant['employee_id'])} for assistant in assistants]
+    inserted = db.session.execute(assistant_table.insert().values(rows)
+                                  .returning(assistant_table.c.id, assistant_table.c.provider_branch_employee_id))
+
+    # RETURNING does not follow the VALUES order, ids are matched back by employee. The rows of
+    # an employee listed twice are identical, so any of them can take either payload entry
+    ids_by_employee = defaultdict(list)
+    for assistant_id, employee_id in inserted:
+        ids_by_employee[employee_id].append(assistant_id)
+    assistant_ids = [ids_by_employee[_as_id(assistant['employee_id'])].pop() for assistant in assistants]
+
+    scores = []
+    for assistant_id, assistant in zip(assistant_ids, assistants):
+        for result in assistant['results']:
+            scores.append({'training_session_assistant_id': assistant_id,
+                           'training_scenario_id': _as_id(result['scenario_id']),
+                           'score': result['score']})
+
+    if scores:
+        db.session.execute(score_table.insert().values(scores))
+        apply_scores(session, scores)
+        invalidate_on_commit(['batch-scores:%s' % session.training_batch_id])
+
+    log.info('Training session id: %s assistants: %s scores: %s', session.id, len(assistant_ids), len(scores))
+    return assistant_ids
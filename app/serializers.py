@@ -0,0 +1,281 @@
+import datetime
+import re
+import uuid
+import simplejson
+from flask import Response
+from werkzeug.http import http_date
+from .models import ScoreRollup
+
+ATTRIBUTE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# compiled selections kept per schema, ?fields= and ?include= come from the clients
+MAX_SELECTIONS = 256
+
+
+def _below(paths, key):
+    if paths is None:
+        return None
+    prefix = key + '.'
+    nested = frozenset(path[len(prefix):] for path in paths if path.startswith(prefix))
+    return nested or None
+
+
+class Selection(object):
+    """Keys to serialize, as given by ?fields= and ?include= (dotted paths reach nested keys).
+
+    fields lists the attributes to keep and include the relations to embed. With neither every key
+    is serialized; with fields alone only the relations it names are embedded.
+    """
+
+    def __init__(self, fields=None, include=None):
+        self.fields = frozenset(fields) if fields is not None else None
+        self.include = frozenset(include) if include is not None else None
+
+    @property
+    def key(self):
+        return self.fields, self.include
+
+    def _names(self, paths, key):
+        return paths is not None and (key in paths or _below(paths, key) is not None)
+
+    def wants(self, key, relation=False):
+        if self.fields is None and self.include is None:
+            return True
+        if relation:
+            return self._names(self.fields, key) or self._names(self.include, key)
+        return self.fields is None or key in self.fields
+
+    def nested(self, key):
+        return Selection(_below(self.fields, key), _below(self.include, key))
+
+
+ALL = Selection()
+
+
+class Nested(object):
+    """A relation serialized by schema (a list of them with many).
+
+    source is an attribute name or a callable receiving (obj, context) that returns the related
+    model(s), for relations loaded in bulk beforehand.
+    """
+
+    def __init__(self, source, schema, many=False):
+        self.source = source
+        self.schema = schema
+        self.many = many
+
+
+class Schema(object):
+    """Ordered (key, source) pairs compiled into a single function returning a dict.
+
+    A source is an attribute name, a Nested or a callable receiving (obj, context); the last two
+    are relations, only serialized (and so only loaded) when a selection wants them. Every
+    selection is compiled once into a function that reads the attributes directly, with no loop
+    over the fields nor per field calls for the plain ones; context is passed down to the
+    callables and nested schemas.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self._sources = dict(fields)
+        self._compiled = {}
+        self.serialize = self._compile(ALL)
+
+    def is_relation(self, key):
+        source = self._sources[key]
+        return isinstance(source, Nested) or callable(source)
+
+    def wants(self, selection, key):
+        return selection.wants(key, self.is_relation(key))
+
+    def validate(self, selection):
+        """Raises ValueError for a path that is not a key of the schema or of its nested schemas."""
+        for paths in (selection.fields, selection.include):
+            for path in paths or ():
+                key, _, rest = path.partition('.')
+                source = self._sources.get(key)
+                if source is None or (rest and not isinstance(source, Nested)):
+                    raise ValueError('%s has no field %s' % (self.name, path))
+                if rest:
+                    try:
+                        source.schema.validate(Selection([rest]))
+                    except ValueError:
+                        raise ValueError('%s has no field %s' % (self.name, path))
+
+    def attributes(self, selection):
+        """Model attributes read for the plain keys of a selection."""
+        return [source for key, source in self.fields if not self.is_relation(key) and selection.wants(key)]
+
+    def select(self, selection):
+        """The serializer of a selection, compiled the first time it is asked for."""
+        if selection.key == ALL.key:
+            return self.serialize
+
+        serialize = self._compiled.get(selection.key)
+        if serialize is None:
+            if len(self._compiled) >= MAX_SELECTIONS:
+                self._compiled.clear()
+            serialize = self._compiled[selection.key] = self._compile(selection)
+        return serialize
+
+    def _compile(self, selection):
+        namespace = {}
+        items = []
+
+        for i, (key, source) in enumerate(self.fields):
+            if not self.wants(selection, key):
+                continue
+
+            if isinstance(source, Nested):
+                namespace['_nested%d' % i] = source.schema.select(selection.nested(key))
+                if callable(source.source):
+                    namespace['_related%d' % i] = source.source
+                    related = '_related%d(obj, context)' % i
+                elif ATTRIBUTE.match(source.source):
+                    related = 'obj.%s' % source.source
+                else:
+                    raise ValueError('%s.%s is not an attribute name' % (self.name, source.source))
+
+                if source.many:
+                    value = '[_nested%d(item, context) for item in %s]' % (i, related)
+                else:
+                    value = '_nested%d(%s, context)' % (i, related)
+            elif callable(source):
+                namespace['_computed%d' % i] = source
+                value = '_computed%d(obj, context)' % i
+            elif ATTRIBUTE.match(source):
+                value = 'obj.%s' % source
+            else:
+                raise ValueError('%s.%s is not an attribute name' % (self.name, source))
+            items.append('%r: %s' % (str(key), value))
+
+        source = 'def serialize_%s(obj, context=None):\n    return {%s}\n' % (self.name, ', '.join(items))
+        exec(compile(source, '<schema %s>' % self.name, 'exec'), namespace)
+        return namespace['serialize_%s' % self.name]
+
+    def many(self, objs, context=None, selection=ALL):
+        serialize = self.select(selection)
+        return [serialize(obj, context) for obj in objs]
+
+
+def _average(scope):
+    # context['averages'] is handed in by the loaders (ScoreRollup.averages), otherwise it is queried
+    def average(obj, context):
+        averages = context.get('averages') if context else None
+        if averages is None:
+            return obj.avg_score
+        return averages.get((scope, obj.id))
+    return average
+
+
+def _session_assistants(session, context):
+    # context['assistants'] holds the assistants of every session loaded at once by the loaders
+    assistants = context.get('assistants') if context else None
+    if assistants is None:
+        return session.assistants
+    return assistants.get(session.id, ())
+
+
+def _rollup_average(rollup, context):
+    return rollup.score_sum / rollup.score_count
+
+
+branch = Schema('branch', [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('latitude', 'latitude'),
+    ('longitude', 'longitude'),
+    ('employees', 'employees_count')
+])
+
+provider = Schema('provider', [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('slug', 'slug'),
+    ('branches', Nested('branches', branch, many=True)),
+    ('branches_count', 'branches_count')
+])
+
+employee = Schema('employee', [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('phone', 'phone'),
+    ('title', 'title')
+])
+
+user = Schema('user', [
+    ('id', 'id'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name')
+])
+
+scenario = Schema('scenario', [
+    ('id', 'id'),
+    ('description', 'description')
+])
+
+batch = Schema('batch', [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('sessions', 'sessions_count')
+])
+
+assistant = Schema('assistant', [
+    ('id', 'id'),
+    ('training_session_id', 'training_session_id'),
+    ('provider_branch_employee_id', 'provider_branch_employee_id'),
+    ('employee', Nested('employee', employee)),
+    ('score', _average(ScoreRollup.ASSISTANT))
+])
+
+session = Schema('session', [
+    ('id', 'id'),
+    ('teacher_id', 'teacher_id'),
+    ('latitude', 'latitude'),
+    ('longitude', 'longitude'),
+    ('comments', 'comments'),
+    ('signature_url', 'signature_url'),
+    ('status', 'status'),
+    ('location_flagged', 'location_flagged'),
+    ('teacher', Nested('teacher', user)),
+    ('avg_score', _average(ScoreRollup.SESSION)),
+    ('assistants', Nested(_session_assistants, assistant, many=True))
+])
+
+score = Schema('score', [
+    ('id', 'id'),
+    ('training_session_assistant_id', 'training_session_assistant_id'),
+    ('scenario', Nested('scenario', scenario)),
+    ('score', 'score')
+])
+
+rollup = Schema('rollup', [
+    ('count', 'score_count'),
+    ('avg', _rollup_average),
+    ('min', 'score_min'),
+    ('max', 'score_max')
+])
+
+
+def _default(value):
+    # what flask's encoder handled besides the types simplejson knows natively
+    if isinstance(value, datetime.datetime):
+        return http_date(value.utctimetuple())
+    if isinstance(value, datetime.date):
+        return http_date(value.timetuple())
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return value.__html__()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+# compact separators, Decimal written as its digits by simplejson's C encoder
+_encoder = simplejson.JSONEncoder(separators=(',', ':'), use_decimal=True, default=_default)
+dumps = _encoder.encode
+
+
+def json_response(body, status=200, headers=None):
+    """Replaces flask's jsonify, which indents its output."""
+    return Response(dumps(body), status=status, headers=headers, mimetype='application/json')
@@ -0,0 +1,113 @@
+from sqlalchemy import text
+from . import db
+
+PERCENTILES = (0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+
+# every (batch, provider, branch, scenario, teacher, score) tuple of the batch
+SCORES = '''
+WITH scores AS (
+  SELECT p.id AS provider_id, p.name AS provider_name,
+         b.id AS branch_id, b.name AS branch_name,
+         sn.id AS scenario_id, sn.description AS scenario_name,
+         u.id AS teacher_id, concat_ws(' ', u.first_name, u.last_name) AS teacher_name,
+         sc.score
+  FROM training.training_session_assistant_scores sc
+  JOIN training.training_session_assistants a ON a.id = sc.training_session_assistant_id
+  JOIN training.training_sessions s ON s.id = a.training_session_id
+  JOIN training.training_scenarios sn ON sn.id = sc.training_scenario_id
+  JOIN public.provider_branches b ON b.id = s.provider_branch_id
+  JOIN public.providers p ON p.id = b.provider_id
+  JOIN public.users u ON u.id = s.teacher_id
+  WHERE s.training_batch_id = :batch_id
+)
+'''
+
+# grouping() bit mask (provider, branch, scenario, teacher) of each grouping set -> report key
+DIMENSIONS = {
+    15: ('overall', None, None),
+    7: ('by_provider', 'provider_id', 'provider_name'),
+    11: ('by_branch', 'branch_id', 'branch_name'),
+    13: ('by_scenario', 'scenario_id', 'scenario_name'),
+    14: ('by_teacher', 'teacher_id', 'teacher_name'),
+}
+
+GROUPING = '''
+grouping(provider_id, branch_id, scenario_id, teacher_id) AS dimension,
+provider_id, provider_name, branch_id, branch_name, scenario_id, scenario_name, teacher_id, teacher_name
+'''
+
+SUMMARY = SCORES + '''
+SELECT ''' + GROUPING + ''',
+       count(*) AS count, avg(score) AS mean, min(score) AS min, max(score) AS max,
+       percentile_cont(CAST(:percentiles AS double precision[])) WITHIN GROUP (ORDER BY score) AS percentiles
+FROM scores
+GROUP BY GROUPING SETS (%s)
+'''
+
+HISTOGRAM = SCORES + '''
+SELECT ''' + GROUPING + ''', bucket, count(*) AS count
+FROM (SELECT *, least(width_bucket(score, 0, 100, :buckets), :buckets) AS bucket FROM scores) bucketed
+GROUP BY GROUPING SETS (%s)
+'''
+
+# report values of every group, the histogram costs a query of its own
+VALUES = ('count', 'mean', 'min', 'max', 'percentiles', 'histogram')
+
+
+def grouping_sets(keys, extra=()):
+    """GROUPING SETS list of the report keys asked for, in the columns DIMENSIONS expects."""
+    sets = []
+    for key, id_column, name_column in DIMENSIONS.values():
+        if key in keys:
+            columns = [id_column, name_column] if id_column is not None else []
+            sets.append('(%s)' % ', '.join(columns + list(extra)))
+    return ', '.join(sets)
+
+
+def _group(report, row):
+    key, id_column, name_column = DIMENSIONS[row.dimension]
+    if id_column is None:
+        return report.setdefault(key, {})
+
+    groups = report.setdefault(key, {})
+    return groups.setdefault(getattr(row, id_column), {'id': getattr(row, id_column), 'name': getattr(row, name_column)})
+
+
+def batch_stats(batch_id, buckets=10, keys=None, values=None):
+    """Score statistics of a batch, overall and by provider, branch, scenario and teacher.
+
+    The aggregation runs in postgres (GROUPING SETS + percentile_cont), one query for the
+    summaries and one for the histograms, whatever the size of the batch. keys restricts the
+    report keys (grouping sets) and values the values of each group; None means all of them.
+    """
+    keys = set(keys) if keys is not None else set(key for key, id_column, name_column in DIMENSIONS.values())
+    values = set(values) if values is not None else set(VALUES)
+    report = dict((key, {}) for key in keys)
+    if not keys:
+        return {'batch_id': batch_id}
+
+    summaries = db.session.execute(text(SUMMARY % grouping_sets(keys)), {'batch_id': batch_id, 'percentiles': list(PERCENTILES)})
+    for row in summaries:
+        group = _group(report, row)
+        group.update({
+            'count': row.count,
+            'mean': row.mean,
+            'min': row.min,
+            'max': row.max,
+            'percentiles': dict(('p%d' % round(p * 100), value) for p, value in zip(PERCENTILES, row.percentiles or [None] * len(PERCENTILES))),
+            'histogram': [{'from': i * 100.0 / buckets, 'to': (i + 1) * 100.0 / buckets, 'count': 0} for i in range(buckets)]
+        })
+        for value in VALUES:
+            if value not in values:
+                del group[value]
+
+    if 'histogram' in values:
+        histograms = db.session.execute(text(HISTOGRAM % grouping_sets(keys, ['bucket'])), {'batch_id': batch_id, 'buckets': buckets})
+        for row in histograms:
+            # width_bucket returns 0 below the range, scores are validated to [0-100]
+            _group(report, row)['histogram'][max(row.bucket, 1) - 1]['count'] = row.count
+
+    result = {'batch_id': batch_id}
+    for key, groups in report.items():
+        result[key] = groups if key == 'overall' else sorted(groups.values(), key=lambda group: group['name'] or '')
+    return result
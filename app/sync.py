@@ -0,0 +1,180 @@
+import base64
+import binascii
+import os
+import six
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from . import db
+from .models import ProviderBranch, User, TrainingSession, SyncReceipt
+from .scoring import add_session_assistants, _as_id
+from .uploads import signature_uploader
+from .exceptions import ValidationError
+from .logger import log
+
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+ERROR = 'error'
+
+
+def _key(item):
+    key = item.get('idempotency_key')
+    if not isinstance(key, six.string_types) or not key or len(key) > 64:
+        raise ValidationError('idempotency_key must be a string of 1 to 64 characters')
+    return key
+
+
+def _signature(finish):
+    comments = finish.get('comments')
+    if comments is None:
+        raise ValidationError('comments cannot be empty')
+
+    if len(comments) > 512:
+        raise ValidationError('comments cannot be longer than 512 characters')
+
+    if finish.get('signature_base64') is None:
+        raise ValidationError('Signature cannot be null')
+
+    try:
+        return comments, base64.b64decode(finish['signature_base64'])
+    except (TypeError, ValueError, binascii.Error):
+        raise ValidationError('signature_base64 is not valid base64')
+
+
+def _existing(column, values):
+    """The ids among values that are rows of column's table, in one query."""
+    ids = set(_as_id(value) for value in values) - set([None])
+    if not ids:
+        return set()
+    return set(found for found, in db.session.query(column).filter(column.in_(ids)))
+
+
+def _create(batch, item, teachers, branches):
+    """Session, assistants, scores, receipt and signature of one item, in the current transaction.
+
+    Returns (session id, path of the spooled signature or None).
+    """
+    finish = item.get('finish')
+    # validated before anything is written or spooled
+    signature = _signature(finish) if finish is not None else None
+
+    session = TrainingSession.from_json(item)
+    # training_sessions has no foreign keys on them
+    if _as_id(item['teacher_id']) not in teachers:
+        raise ValidationError('Teacher %s does not exist' % item['teacher_id'])
+    if _as_id(item['provider_branch_id']) not in branches:
+        raise ValidationError('Branch %s does not exist' % item['provider_branch_id'])
+    session.batch = batch
+    db.session.add(session)
+    db.session.flush()
+
+    add_session_assistants(session, item.get('assistants') or [])
+    db.session.add(SyncReceipt(idempotency_key=item['idempotency_key'], training_session_id=session.id))
+    # a concurrent retry with the same key fails here, before the signature is spooled
+    db.session.flush()
+
+    path = None
+    if signature is not None:
+        comments, data = signature
+        tmp_path, size, checksum = signature_uploader.spool(data)
+        # the session is not committed yet, no other request can finish it
+        path = signature_uploader.keep(tmp_path, session.id)
+        session.comments = comments
+        session.signature_sha256 = checksum
+        session.status = TrainingSession.FINISHING
+
+    return session.id, path
+
+
+def sync_sessions(batch, items):
+    """Creates the complete sessions recorded offline by a trainer, one transaction per item.
+
+    Every item is a new session document (provider_branch_id, teacher_id, latitude, longitude)
+    with its assistants payload (see add_session_assistants), an optional finish object
+    ({"comments", "signature_base64"}) and a client generated idempotency_key. Items whose key
+    was already synced are not inserted again, they report the session created the first time.
+    A failing item is rolled back alone and reported, the others are still committed.
+
+    Returns one {"idempotency_key", "status", "session_id", "message"} result per item, in order.
+    """
+    batch_id = batch.id
+    max_items = current_app.config['SYNC_MAX_ITEMS']
+    if len(items) > max_items:
+        raise ValidationError('sessions cannot have more than %s items' % max_items)
+
+    # the keys synced by previous uploads, the teachers and the branches, a query each
+    documents = [item for item in items if isinstance(item, dict)]
+    keys = [item.get('idempotency_key') for item in documents]
+    keys = [key for key in keys if isinstance(key, six.string_types)]
+    synced = {}
+    if keys:
+        synced = dict(db.session.query(SyncReceipt.idempotency_key, SyncReceipt.training_session_id)
+                                .filter(SyncReceipt.idempotency_key.in_(keys)))
+    teachers = _existing(User.id, [item.get('teacher_id') for item in documents])
+    branches = _existing(ProviderBranch.id, [item.get('provider_branch_id') for item in documents])
+
+    results = []
+    for item in items:
+        result = {'idempotency_key': item.get('idempotency_key') if isinstance(item, dict) else None,
+                  'status': None, 'session_id': None, 'message': None}
+        results.append(result)
+        key = None
+        path = None
+
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError('every item must be an object')
+
+            key = _key(item)
+            if key in synced:
+                result.update(status=DUPLICATE, session_id=synced[key])
+                continue
+
+            # whatever fails inside the savepoint is rolled back before the error is reported
+            with db.session.begin_nested():
+                session_id, path = _create(batch, item, teachers, branches)
+            db.session.commit()
+        except ValidationError as e:
+            db.session.rollback()
+            result.update(status=ERROR, message=e.args[0])
+            _discard(path)
+            continue
+        except IntegrityError as e:
+            db.session.rollback()
+            _discard(path)
+            # the same key committed by a concurrent retry of this upload
+            receipt = SyncReceipt.query.get(key)
+            if receipt is None:
+                log.error('sync item %s rejected by the database: %s' % (key, e))
+                result.update(status=ERROR, message='Session rejected by the database')
+                continue
+            synced[key] = receipt.training_session_id
+            result.update(status=DUPLICATE, session_id=receipt.training_session_id)
+            continue
+        except (SQLAlchemyError, KeyError, TypeError, ValueError) as e:
+            # a malformed assistants payload (missing or mistyped results and scores) or values
+            # the columns refuse: the item is reported, the ones already committed stay
+            db.session.rollback()
+            _discard(path)
+            if isinstance(e, KeyError):
+                message = '%s cannot be empty' % e.args[0]
+            elif isinstance(e, SQLAlchemyError):
+                log.error('sync item %s rejected by the database: %s' % (key, e))
+                message = 'Session rejected by the database'
+            else:
+                message = 'Session is not valid: %s' % e
+            result.update(status=ERROR, message=message)
+            continue
+
+        synced[key] = session_id
+        result.update(status=CREATED, session_id=session_id)
+        if path is not None:
+            signature_uploader.submit(session_id)
+
+    log.info('sync batch %s: %s' % (batch_id, ', '.join('%s %s' % (status, sum(1 for result in results if result['status'] == status))
+                                                        for status in (CREATED, DUPLICATE, ERROR))))
+    return results
+
+
+def _discard(path):
+    if path is not None and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,183 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import tempfile
+from six.moves import queue
+from . import db
+from .exceptions import ValidationError
+from .models import TrainingSession
+from .loaders import freeze_session
+from .s3 import store_file
+from .metrics import metrics
+from .logger import log
+
+
+class SignatureUploader(object):
+    """Uploads finished sessions' signatures in background threads.
+
+    finish_training_session only spools the decoded signature to SIGNATURE_SPOOL_DIR and marks the
+    session as finishing; a pool of SIGNATURE_UPLOAD_WORKERS threads per process then uploads it,
+    fills in signature_url and retries SIGNATURE_UPLOAD_RETRIES times with exponential backoff.
+    Spooled files survive restarts, python manage.py resume_uploads picks them up again.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['signature_uploader'] = self
+
+    def spool_path(self, session_id):
+        return os.path.join(self.app.config['SIGNATURE_SPOOL_DIR'], '%s.jpg' % session_id)
+
+    def spool(self, data):
+        """Writes an in-memory signature to the spool, see spool_stream."""
+        return self.spool_stream(io.BytesIO(data))
+
+    def spool_stream(self, stream, chunk_size=64 * 1024):
+        """Copies a signature to the spool chunk by chunk, enforcing SIGNATURE_MAX_BYTES.
+
+        Every request writes its own temporary file, which keep() names after the session once the
+        session is marked as finishing, so the uploader never sees a partial signature nor the one
+        of a request that lost the race to finish the session. Returns (temporary path, size,
+        sha256 hex digest).
+        """
+        spool_dir = self.app.config['SIGNATURE_SPOOL_DIR']
+        max_bytes = self.app.config['SIGNATURE_MAX_BYTES']
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+
+        checksum = hashlib.sha256()
+        size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=spool_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValidationError('Signature cannot be larger than %s bytes' % max_bytes)
+
+                    checksum.update(chunk)
+                    f.write(chunk)
+
+            if size == 0:
+                raise ValidationError('Signature cannot be null')
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        return tmp_path, size, checksum.hexdigest()
+
+    def keep(self, tmp_path, session_id):
+        """Names a spooled signature after its session, where upload() and pending() look for it."""
+        path = self.spool_path(session_id)
+        os.rename(tmp_path, path)
+        return path
+
+    def submit(self, session_id):
+        self._ensure_workers()
+        self._queue.put(session_id)
+
+    def _ensure_workers(self):
+        # threads do not survive gunicorn's fork, so every worker process starts its own pool
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            for i in range(self.app.config['SIGNATURE_UPLOAD_WORKERS']):
+                worker = threading.Thread(target=self._work, name='signature-uploader-%s' % i)
+                worker.daemon = True
+                worker.start()
+
+    def _work(self):
+        while True:
+            session_id = self._queue.get()
+            try:
+                self.upload(session_id)
+            except Exception:
+                log.exception('signature upload of session %s crashed' % session_id)
+            finally:
+                self._queue.task_done()
+
+    def upload(self, session_id):
+        """Uploads the spooled signature of a session, retrying with backoff. Returns True on success."""
+        retries = self.app.config['SIGNATURE_UPLOAD_RETRIES']
+        backoff = self.app.config['SIGNATURE_UPLOAD_BACKOFF']
+        path = self.spool_path(session_id)
+
+        with self.app.app_context():
+            for attempt in range(retries):
+                session = TrainingSession.query.get(session_id)
+                if session is None or session.status == TrainingSession.FINISHED:
+                    return True
+
+                session.upload_attempts += 1
+                start = time.time()
+                try:
+                    url = self._store(session, path)
+                except Exception:
+                    metrics.observe_upload(time.time() - start, False)
+                    log.exception('signature upload of session %s failed, attempt %s of %s' % (session_id, attempt + 1, retries))
+                    db.session.commit()
+                    # backs off only when another attempt follows
+                    if attempt + 1 < retries:
+                        time.sleep(backoff * 2 ** attempt)
+                    continue
+
+                metrics.observe_upload(time.time() - start, True)
+                session.signature_url = url
+                session.status = TrainingSession.FINISHED
+                db.session.commit()
+                os.remove(path)
+                log.info('signature of session %s uploaded to %s' % (session_id, url))
+
+                # the session is finished even if its json cannot be rendered now, backfill_sessions_json does it later
+                try:
+                    freeze_session(session)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    log.exception('rendering the json of session %s failed' % session_id)
+                return True
+
+            session = TrainingSession.query.get(session_id)
+            session.status = TrainingSession.UPLOAD_FAILED
+            db.session.commit()
+            log.error('signature upload of session %s gave up after %s attempts' % (session_id, retries))
+            return False
+
+    def _store(self, session, path):
+        # a retried or duplicated submission was already uploaded for another session
+        if session.signature_sha256 is not None:
+            existing = db.session.query(TrainingSession.signature_url) \
+                                 .filter(TrainingSession.signature_sha256 == session.signature_sha256) \
+                                 .filter(TrainingSession.signature_url.isnot(None)).first()
+            if existing is not None:
+                return existing.signature_url
+
+        return store_file(path, session.signature_sha256)
+
+    def pending(self):
+        """Ids of the sessions whose signature is still waiting in the spool."""
+        with self.app.app_context():
+            sessions = db.session.query(TrainingSession.id) \
+                                 .filter(TrainingSession.status.in_([TrainingSession.FINISHING, TrainingSession.UPLOAD_FAILED]))
+            return [session_id for session_id, in sessions if os.path.exists(self.spool_path(session_id))]
+
+
+signature_uploader = SignatureUploader()
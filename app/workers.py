@@ -0,0 +1,63 @@
+from .logger import log
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+
+def pool_size(app, worker_class, threads=1, worker_connections=1000):
+    """(SQLALCHEMY_POOL_SIZE, SQLALCHEMY_MAX_OVERFLOW) of a worker process in the given mode.
+
+    Every request in flight holds a connection, and so does every signature upload thread. Green
+    workers may run worker_connections requests at once, far more than postgres accepts, so their
+    pool stops at GEVENT_DB_POOL_SIZE and the other requests wait for a connection.
+    """
+    uploads = app.config['SIGNATURE_UPLOAD_WORKERS']
+
+    if worker_class == 'sync':
+        return 1 + uploads, 0
+    if worker_class == 'gthread':
+        return threads + uploads, 0
+    if worker_class == 'gevent':
+        size = min(worker_connections, app.config['GEVENT_DB_POOL_SIZE'])
+        return size + uploads, app.config['GEVENT_DB_MAX_OVERFLOW']
+    raise ValueError('unknown worker class %s, use one of %s' % (worker_class, ', '.join(WORKER_CLASSES)))
+
+
+def configure_pool(app, worker_class, workers, threads=1, worker_connections=1000):
+    """Sets the pool of the mode unless SQLALCHEMY_POOL_SIZE is configured, logs the connections needed."""
+    size, overflow = pool_size(app, worker_class, threads, worker_connections)
+    # Flask-SQLAlchemy defaults both keys to None
+    if app.config.get('SQLALCHEMY_POOL_SIZE') is None:
+        app.config['SQLALCHEMY_POOL_SIZE'] = size
+    if app.config.get('SQLALCHEMY_MAX_OVERFLOW') is None:
+        app.config['SQLALCHEMY_MAX_OVERFLOW'] = overflow
+
+    connections = workers * (app.config['SQLALCHEMY_POOL_SIZE'] + app.config['SQLALCHEMY_MAX_OVERFLOW'])
+    log.info('%s %s workers, db pool %s + %s overflow per worker, up to %s postgres connections' %
+             (workers, worker_class, app.config['SQLALCHEMY_POOL_SIZE'], app.config['SQLALCHEMY_MAX_OVERFLOW'], connections))
+
+
+def _gevent_wait_callback(connection, timeout=None):
+    """psycopg2 wait callback yielding to the gevent hub while the socket is not ready."""
+    from psycopg2 import extensions, OperationalError
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise OperationalError('bad state from poll: %s' % state)
+
+
+def make_psycopg2_green():
+    """Makes psycopg2 wait for the database through gevent.
+
+    psycopg2 is a C extension that monkey patching does not reach: without the wait callback a
+    query blocks the whole worker instead of only the greenlet running it.
+    """
+    from psycopg2 import extensions
+    extensions.set_wait_callback(_gevent_wait_callback)
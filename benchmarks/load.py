@@ -0,0 +1,271 @@
+"""Load test replaying a weighted mix of endpoints against gunicorn.
+
+    python manage.py benchmark --save benchmarks/baseline.json
+    python manage.py benchmark --baseline benchmarks/baseline.json --threshold 0.2
+
+Run it on a database filled by python manage.py db seed. The mix (benchmarks/mix.json by
+default) is a list of {"name", "method", "path", "weight"} entries, with an optional "json"
+body. Paths and bodies may use the {provider_slug}, {branch_id}, {batch_id}, {session_id},
+{employee_id}, {scenario_id}, {latitude} and {longitude} placeholders, filled with rows sampled
+from the database; employee_id belongs to the branch of session_id. Entries marked "unique" get
+an open session of their own that no other request uses (finishing a session works once).
+Query counts and db time come from the Server-Timing header of every response.
+"""
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from six.moves import http_client
+from six.moves.urllib.parse import urlparse
+from app import db
+from sqlalchemy import func
+from app.models import Provider, ProviderBranch, ProviderBranchEmployee, TrainingScenario, TrainingSession
+
+MIX = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mix.json')
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def load_mix(path=MIX):
+    with open(path) as f:
+        mix = json.load(f)
+    for entry in mix:
+        entry.setdefault('method', 'GET')
+        entry.setdefault('weight', 1)
+    return mix
+
+
+def sample(rng, size=500):
+    """Rows the mix placeholders are filled with, the same ones for the same seeded data.
+
+    Returns {'branches', 'sessions', 'open_sessions', 'scenarios'}: size branches and sessions
+    shared by the requests, and the open sessions left for the unique entries.
+    """
+    branches = db.session.query(Provider.slug, ProviderBranch.id).join(ProviderBranch.provider) \
+                         .order_by(ProviderBranch.id).all()
+    employees = dict(db.session.query(ProviderBranchEmployee.provider_branch_id, func.min(ProviderBranchEmployee.id))
+                               .group_by(ProviderBranchEmployee.provider_branch_id))
+    sessions = [(batch_id, session_id, employees.get(branch_id), status) for batch_id, session_id, branch_id, status in
+                db.session.query(TrainingSession.training_batch_id, TrainingSession.id,
+                                 TrainingSession.provider_branch_id, TrainingSession.status).order_by(TrainingSession.id)]
+    scenarios = [scenario_id for scenario_id, in db.session.query(TrainingScenario.id).order_by(TrainingScenario.id)]
+    if not branches or not sessions or not scenarios:
+        raise RuntimeError('the database has no branches, sessions or scenarios, run python manage.py db seed first')
+
+    rng.shuffle(sessions)
+    return {
+        'branches': rng.sample(branches, min(size, len(branches))),
+        'sessions': [session[:3] for session in sessions[:size]],
+        'open_sessions': [session[:3] for session in sessions[size:] if session[3] == TrainingSession.OPEN],
+        'scenarios': scenarios
+    }
+
+
+def _fill(template, values):
+    return PLACEHOLDER.sub(lambda match: str(values[match.group(1)]), template)
+
+
+def plan(mix, samples, requests, seed=0):
+    """The (name, method, path, body) requests to replay, reproducible for a seed."""
+    rng = random.Random(seed)
+    open_sessions = list(samples['open_sessions'])
+    cumulative = []
+    total = 0
+    for entry in mix:
+        total += entry['weight']
+        cumulative.append(total)
+
+    planned = []
+    for i in range(requests):
+        point = rng.random() * total
+        entry = mix[next(index for index, bound in enumerate(cumulative) if point < bound)]
+        provider_slug, branch_id = rng.choice(samples['branches'])
+
+        if entry.get('unique'):
+            if not open_sessions:
+                raise RuntimeError('not enough open sessions for %s, seed more sessions' % entry['name'])
+            batch_id, session_id, employee_id = open_sessions.pop()
+        else:
+            batch_id, session_id, employee_id = rng.choice(samples['sessions'])
+
+        values = {'provider_slug': provider_slug, 'branch_id': branch_id, 'batch_id': batch_id, 'session_id': session_id,
+                  'employee_id': employee_id, 'scenario_id': rng.choice(samples['scenarios']),
+                  'latitude': round(13.5 + rng.random() * 4, 5), 'longitude': round(-92 + rng.random() * 4, 5)}
+        body = entry.get('json')
+        planned.append((entry['name'], entry['method'], _fill(entry['path'], values),
+                        _fill(json.dumps(body), values) if body is not None else None))
+    return planned
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def replay(url, planned, concurrency=10):
+    """Sends the planned requests over concurrency keep-alive connections, returns the samples by name."""
+    target = urlparse(url)
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    position = [0]
+
+    def worker():
+        connection = http_client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+        while True:
+            with lock:
+                if position[0] >= len(planned):
+                    break
+                name, method, path, body = planned[position[0]]
+                position[0] += 1
+
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            started = time.time()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+            except (http_client.HTTPException, IOError):
+                connection.close()
+                connection = http_client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+                with lock:
+                    samples[name].append((time.time() - started, 599, None, None))
+                continue
+
+            elapsed = time.time() - started
+            match = SERVER_TIMING_DB.search(response.getheader('Server-Timing') or '')
+            with lock:
+                samples[name].append((elapsed, response.status,
+                                      int(match.group(2)) if match else None,
+                                      float(match.group(1)) if match else None))
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.time() - started
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for name, results in samples.items():
+        latencies = [result[0] * 1000 for result in results]
+        queries = [result[2] for result in results if result[2] is not None]
+        db_times = [result[3] for result in results if result[3] is not None]
+        endpoints[name] = {
+            'requests': len(results),
+            'errors': len([result for result in results if result[1] >= 400]),
+            'throughput': len(results) / elapsed,
+            'p50_ms': _percentile(latencies, 0.5),
+            'p95_ms': _percentile(latencies, 0.95),
+            'p99_ms': _percentile(latencies, 0.99),
+            'queries': float(sum(queries)) / len(queries) if queries else None,
+            'db_ms': sum(db_times) / len(db_times) if db_times else None
+        }
+
+    total = sum(len(results) for results in samples.values())
+    return {'elapsed': elapsed, 'requests': total, 'throughput': total / elapsed, 'endpoints': endpoints}
+
+
+def compare(report, baseline, threshold=0.2):
+    """Regressions of report against baseline: slower p95, lower throughput or more queries."""
+    regressions = []
+    for name, current in sorted(report['endpoints'].items()):
+        previous = baseline['endpoints'].get(name)
+        if previous is None:
+            continue
+
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append('%s: p95 %.1fms, baseline %.1fms' % (name, current['p95_ms'], previous['p95_ms']))
+        if current['throughput'] < previous['throughput'] * (1 - threshold):
+            regressions.append('%s: %.1f req/s, baseline %.1f req/s' % (name, current['throughput'], previous['throughput']))
+        # query counts do not depend on the machine, any increase is a regression
+        if current['queries'] is not None and previous['queries'] is not None and current['queries'] > previous['queries'] + 0.01:
+            regressions.append('%s: %.2f queries per request, baseline %.2f' % (name, current['queries'], previous['queries']))
+        if current['errors'] > previous['errors']:
+            regressions.append('%s: %s errors, baseline %s' % (name, current['errors'], previous['errors']))
+    return regressions
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _wait_until_up(url, timeout=30):
+    target = urlparse(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http_client.HTTPConnection(target.hostname, target.port or 80, timeout=1)
+            connection.request('GET', '/training/scenarios')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except (http_client.HTTPException, IOError):
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start in %s seconds' % timeout)
+
+
+def start_gunicorn(port, workers, extra_args=()):
+    """python manage.py gunicorn in a subprocess, with the production config unless FLASK_CONFIG is set."""
+    env = dict(os.environ)
+    env.setdefault('FLASK_CONFIG', 'production')
+    manage = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'manage.py')
+    server = subprocess.Popen([sys.executable, manage, 'gunicorn', '-h', '127.0.0.1', '-p', str(port), '-w', str(workers)] + list(extra_args), env=env)
+    try:
+        _wait_until_up('http://127.0.0.1:%s' % port)
+    except Exception:
+        server.terminate()
+        raise
+    return server
+
+
+def print_report(report):
+    print('%-20s %8s %6s %9s %9s %9s %9s %8s %8s' % ('endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'db ms'))
+    for name, endpoint in sorted(report['endpoints'].items()):
+        print('%-20s %8d %6d %9.1f %9.1f %9.1f %9.1f %8s %8s' % (
+            name, endpoint['requests'], endpoint['errors'], endpoint['throughput'],
+            endpoint['p50_ms'], endpoint['p95_ms'], endpoint['p99_ms'],
+            '%.2f' % endpoint['queries'] if endpoint['queries'] is not None else '-',
+            '%.1f' % endpoint['db_ms'] if endpoint['db_ms'] is not None else '-'))
+    print('%s requests in %.2fs, %.1f req/s' % (report['requests'], report['elapsed'], report['throughput']))
+
+
+def run(url=None, mix=MIX, requests=5000, concurrency=10, warmup=200, workers=10, seed=0, gunicorn_args=()):
+    """Replays the mix against url, or against a gunicorn started on a free port when url is None."""
+    planned = plan(load_mix(mix), sample(random.Random(seed)), requests + warmup, seed)
+    db.session.remove()
+
+    server = None
+    if url is None:
+        port = _free_port()
+        server = start_gunicorn(port, workers, gunicorn_args)
+        url = 'http://127.0.0.1:%s' % port
+
+    try:
+        # fills the caches, the connection pools and the branch index of the workers
+        replay(url, planned[:warmup], concurrency)
+        samples, elapsed = replay(url, planned[warmup:], concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = summarize(samples, elapsed)
+    report['parameters'] = {'mix': os.path.basename(mix), 'requests': requests, 'concurrency': concurrency,
+                            'workers': workers, 'seed': seed, 'gunicorn_args': list(gunicorn_args)}
+    return report
@@ -0,0 +1,89 @@
+"""EXPLAIN of the queries behind each endpoint, failing on sequential scans of large tables.
+
+Run on a seeded database (python manage.py db seed), on small tables the planner rightly
+prefers sequential scans, hence min_rows.
+"""
+from sqlalchemy import func, select, text
+from app import db
+from app.models import Provider, ProviderBranch, ProviderBranchEmployee, TrainingBatch, TrainingSession, \
+    TrainingSessionAssistant, TrainingSessionAssistantScore, ScoreRollup
+from app.api.conditional import freshness
+from app.api.pagination import nullable_key
+from app.stats import SUMMARY, DIMENSIONS, grouping_sets
+
+
+def _sample():
+    """Ids to plan with, taken from the seeded data."""
+    provider = Provider.query.order_by(Provider.id).first()
+    branch = ProviderBranch.query.filter(ProviderBranch.provider_id == provider.id).order_by(ProviderBranch.id).first()
+    batch = TrainingBatch.query.order_by(TrainingBatch.id).first()
+    sessions = [session_id for session_id, in db.session.query(TrainingSession.id)
+                                                        .filter(TrainingSession.training_batch_id == batch.id)
+                                                        .order_by(TrainingSession.id).limit(100)]
+    return provider, branch, batch, sessions
+
+
+def endpoint_queries():
+    """(endpoint, statement) of the queries each endpoint runs, with realistic parameters."""
+    provider, branch, batch, sessions = _sample()
+    page = 100
+
+    return [
+        ('get_providers', Provider.query.order_by(nullable_key(Provider.name), Provider.id).limit(page).statement),
+        ('get_branches provider', Provider.query.filter(Provider.slug == provider.slug).statement),
+        ('get_branches', ProviderBranch.query.filter(ProviderBranch.provider_id == provider.id)
+                                             .order_by(nullable_key(ProviderBranch.name), ProviderBranch.id).limit(page).statement),
+        ('get_employees', ProviderBranchEmployee.query.filter(ProviderBranchEmployee.provider_branch_id == branch.id)
+                                                      .order_by(ProviderBranchEmployee.name, ProviderBranchEmployee.id).limit(page).statement),
+        ('get_employees freshness', select(freshness(ProviderBranchEmployee, ProviderBranchEmployee.provider_branch_id == branch.id))),
+        ('get_batches', TrainingBatch.query.order_by(nullable_key(TrainingBatch.name), TrainingBatch.id).limit(page).statement),
+        ('get_training_sessions_by_batch', TrainingSession.query.filter(TrainingSession.training_batch_id == batch.id)
+                                                                .filter(TrainingSession.id > sessions[0])
+                                                                .order_by(TrainingSession.id).limit(page).statement),
+        ('get_training_sessions_by_batch freshness', select(freshness(TrainingSession, TrainingSession.training_batch_id == batch.id) +
+                                                            freshness(TrainingSessionAssistant, TrainingSessionAssistant.session.has(training_batch_id=batch.id)))),
+        ('sessions_to_json assistants', TrainingSessionAssistant.query.filter(TrainingSessionAssistant.training_session_id.in_(sessions))
+                                                                      .order_by(TrainingSessionAssistant.id).statement),
+        ('sessions_to_json rollups', select([ScoreRollup.scope_id, ScoreRollup.score_sum / ScoreRollup.score_count])
+                                     .where(ScoreRollup.scope == ScoreRollup.SESSION).where(ScoreRollup.scope_id.in_(sessions))),
+        ('get_training_session', select([TrainingSession.serialized_json]).where(TrainingSession.id == sessions[0])
+                                                                         .where(TrainingSession.training_batch_id == batch.id)),
+        ('get_batch_stats', (SUMMARY % grouping_sets([key for key, id_column, name_column in DIMENSIONS.values()]),
+                             {'batch_id': batch.id, 'percentiles': [0.5]})),
+        ('recount scores of a session', select([func.count()]).select_from(TrainingSessionAssistantScore.__table__.join(TrainingSessionAssistant.__table__))
+                                        .where(TrainingSessionAssistant.training_session_id == sessions[0])),
+    ]
+
+
+def _seq_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        for relation in _seq_scans(child):
+            yield relation
+
+
+def _compile(statement):
+    if isinstance(statement, tuple):
+        # raw sql with :name parameters
+        sql, params = statement
+        statement = text(sql).bindparams(**params)
+
+    compiled = statement.compile(dialect=db.engine.dialect)
+    return str(compiled), compiled.params
+
+
+def check_plans(min_rows=10000):
+    """Returns [(endpoint, [tables seq scanned with at least min_rows rows])], empty lists pass."""
+    sizes = dict(db.session.execute('SELECT relname, reltuples FROM pg_class WHERE relkind = \'r\''))
+    cursor = db.session.connection().connection.cursor()
+    results = []
+
+    for endpoint, statement in endpoint_queries():
+        sql, params = _compile(statement)
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0][0]['Plan']
+        large = sorted(set(relation for relation in _seq_scans(plan) if sizes.get(relation, 0) >= min_rows))
+        results.append((endpoint, large))
+
+    return results
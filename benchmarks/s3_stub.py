@@ -0,0 +1,68 @@
+"""Minimal S3 compatible HTTP server for benchmarks: keeps objects in memory and counts requests."""
+import hashlib
+import threading
+from collections import Counter
+from six.moves import BaseHTTPServer, socketserver
+
+
+class S3Stub(object):
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.objects = {}
+        self.requests = Counter()
+        self.connections = 0
+        stub = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                stub.connections += 1
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def do_PUT(self):
+                stub.requests['PUT'] += 1
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                stub.objects[self.path.split('?')[0]] = body
+                self._reply(200, headers={'ETag': '"%s"' % hashlib.md5(body).hexdigest()})
+
+            def do_GET(self):
+                stub.requests['GET'] += 1
+                body = stub.objects.get(self.path.split('?')[0])
+                if body is None:
+                    return self._reply(404)
+                self._reply(200, body)
+
+            def do_HEAD(self):
+                stub.requests['HEAD'] += 1
+                body = stub.objects.get(self.path.split('?')[0])
+                if body is None:
+                    return self._reply(404)
+                self._reply(200, headers={'ETag': '"%s"' % hashlib.md5(body).hexdigest()})
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        self.host, self.port = self.server.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
@@ -0,0 +1,52 @@
+"""Signature upload benchmark against the local S3 stand-in.
+
+    python -m benchmarks.s3_upload [uploads]
+
+Every upload is a new object (the content addressed key would make repeated uploads no-ops).
+Fails when an upload costs more than one request or opens a new HTTP connection.
+"""
+import os
+import sys
+import tempfile
+import time
+from app import create_app
+from app.s3 import get_storage
+from .s3_stub import S3Stub
+
+
+def run(uploads=200, size=30 * 1024):
+    stub = S3Stub().start()
+
+    app = create_app('testing')
+    app.config.update(SIGNATURE_STORAGE='s3', AWS_ACCESS_KEY='bench', AWS_SECRET_KEY='bench', AWS_BUCKET_NAME='bench',
+                      AWS_S3_HOST=stub.host, AWS_S3_PORT=stub.port, AWS_S3_SECURE=False)
+
+    fd, path = tempfile.mkstemp(suffix='.jpg')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(os.urandom(size))
+
+    try:
+        with app.app_context():
+            storage = get_storage()
+            storage.put(path, 'training/signatures/warmup.jpg', 'image/jpeg')
+            stub.requests.clear()
+            connections = stub.connections
+
+            started = time.time()
+            for i in range(uploads):
+                storage.put(path, 'training/signatures/%s.jpg' % i, 'image/jpeg')
+            elapsed = time.time() - started
+    finally:
+        os.remove(path)
+        stub.stop()
+
+    requests = sum(stub.requests.values())
+    print('%s uploads of %s bytes in %.3fs (%.2f ms/upload)' % (uploads, size, elapsed, elapsed * 1000 / uploads))
+    print('requests per upload: %.2f %s' % (float(requests) / uploads, dict(stub.requests)))
+    print('new connections: %s' % (stub.connections - connections))
+
+    return requests == uploads and stub.requests['PUT'] == uploads and stub.connections == connections
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run(*[int(arg) for arg in sys.argv[1:2]]) else 1)
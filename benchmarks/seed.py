@@ -0,0 +1,87 @@
+"""Reproducible synthetic dataset, generated inside postgres with generate_series.
+
+Meant for an empty local database migrated with python manage.py db upgrade; rows are
+added on top of whatever is there. The same seed and volumes always produce the same data.
+"""
+from app import db
+from app.rollups import rebuild
+
+VOLUMES = {
+    'providers': 50,
+    'branches_per_provider': 20,
+    'employees_per_branch': 30,
+    'teachers': 100,
+    'scenarios': 10,
+    'batches': 10,
+    'sessions_per_batch': 2000,
+    'assistants_per_session': 15,
+}
+
+STATEMENTS = (
+    '''INSERT INTO public.providers (name, slug)
+       SELECT 'Provider ' || i, 'provider-' || i FROM generate_series(1, %(providers)s) i''',
+
+    '''INSERT INTO public.provider_branches (provider_id, name, latitude, longitude)
+       SELECT p.id, p.name || ' branch ' || j, 13.5 + random() * 4, -92 + random() * 4
+       FROM public.providers p, generate_series(1, %(branches_per_provider)s) j''',
+
+    '''INSERT INTO training.provider_branch_employees (provider_branch_id, name, phone, title)
+       SELECT b.id, 'Employee ' || b.id || '-' || j, '555-' || lpad(j::text, 4, '0'), 'Cashier'
+       FROM public.provider_branches b, generate_series(1, %(employees_per_branch)s) j''',
+
+    '''INSERT INTO public.users (first_name, last_name)
+       SELECT 'Teacher', 'No. ' || i FROM generate_series(1, %(teachers)s) i''',
+
+    '''INSERT INTO training.training_scenarios (description)
+       SELECT 'Scenario ' || i FROM generate_series(1, %(scenarios)s) i''',
+
+    '''INSERT INTO training.training_batches (name)
+       SELECT 'Batch ' || i FROM generate_series(1, %(batches)s) i''',
+
+    '''WITH branches AS (SELECT array_agg(id) AS ids FROM public.provider_branches),
+            teachers AS (SELECT array_agg(id) AS ids FROM public.users)
+       INSERT INTO training.training_sessions (training_batch_id, provider_branch_id, teacher_id, latitude, longitude, comments)
+       SELECT b.id, branches.ids[1 + floor(random() * array_length(branches.ids, 1))::int],
+              teachers.ids[1 + floor(random() * array_length(teachers.ids, 1))::int],
+              13.5 + random() * 4, -92 + random() * 4, 'seeded'
+       FROM training.training_batches b, generate_series(1, %(sessions_per_batch)s) j, branches, teachers''',
+
+    '''INSERT INTO training.training_session_assistants (training_session_id, provider_branch_employee_id)
+       SELECT s.id, e.id
+       FROM training.training_sessions s
+       JOIN LATERAL (SELECT id FROM training.provider_branch_employees
+                     WHERE provider_branch_id = s.provider_branch_id
+                     ORDER BY random() LIMIT %(assistants_per_session)s) e ON true''',
+
+    '''INSERT INTO training.training_session_assistant_scores (training_session_assistant_id, training_scenario_id, score)
+       SELECT a.id, sn.id, round((50 + random() * 50)::numeric, 2)
+       FROM training.training_session_assistants a, training.training_scenarios sn''',
+)
+
+
+def seed(seed=0.42, **volumes):
+    """Generates the dataset, returns the volumes used."""
+    params = dict(VOLUMES)
+    params.update((key, value) for key, value in volumes.items() if value is not None)
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT setseed(%s)', (seed,))
+        for statement in STATEMENTS:
+            cursor.execute(statement, params)
+        connection.commit()
+    finally:
+        connection.close()
+
+    rebuild()
+
+    # fresh statistics, otherwise the planner still believes the tables are empty
+    connection = db.engine.raw_connection()
+    try:
+        connection.set_isolation_level(0)
+        connection.cursor().execute('ANALYZE')
+    finally:
+        connection.close()
+
+    return params
@@ -0,0 +1,106 @@
+"""Session serialization benchmark: compiled schemas + compact encoder against the former path.
+
+    python -m benchmarks.serializers [sessions] [assistants per session]
+
+The former path is the hand-written to_json dicts dumped by flask's encoder with indentation,
+as jsonify did. Both run on the same in-memory models and must produce the same document.
+"""
+import decimal
+import sys
+import time
+from collections import defaultdict
+from flask import json
+from app import create_app
+from app import serializers
+from app.models import ProviderBranchEmployee, User, TrainingSession, TrainingSessionAssistant, ScoreRollup
+
+
+def _models(sessions, assistants_per_session):
+    teachers = [User(id=i, first_name='Teacher', last_name='No. %s' % i) for i in range(10)]
+    employees = [ProviderBranchEmployee(id=i, name='Employee %s' % i, phone='555-%04d' % i, title='Cashier') for i in range(100)]
+    averages = {}
+    rows = []
+    assistants = []
+
+    for i in range(sessions):
+        session = TrainingSession(id=i, teacher_id=i % 10, latitude=14.6, longitude=-90.5, comments='seeded',
+                                  signature_url='https://example.com/%s.jpg' % i, status=TrainingSession.FINISHED,
+                                  location_flagged=False)
+        session.teacher = teachers[i % 10]
+        averages[(ScoreRollup.SESSION, i)] = decimal.Decimal('81.25')
+        rows.append(session)
+
+        for j in range(assistants_per_session):
+            assistant_id = i * assistants_per_session + j
+            assistant = TrainingSessionAssistant(id=assistant_id, training_session_id=i, provider_branch_employee_id=j)
+            assistant.employee = employees[j % 100]
+            averages[(ScoreRollup.ASSISTANT, assistant_id)] = decimal.Decimal('78.5')
+            assistants.append(assistant)
+
+    return rows, assistants, averages
+
+
+def _former(sessions, assistants, averages):
+    """The to_json methods as they were written before the schemas."""
+    by_session = defaultdict(list)
+    for assistant in assistants:
+        employee = assistant.employee
+        by_session[assistant.training_session_id].append({
+            'id': assistant.id,
+            'training_session_id': assistant.training_session_id,
+            'provider_branch_employee_id': assistant.provider_branch_employee_id,
+            'employee': {'id': employee.id, 'name': employee.name, 'phone': employee.phone, 'title': employee.title},
+            'score': averages.get((ScoreRollup.ASSISTANT, assistant.id))
+        })
+
+    content = [{
+        'id': session.id,
+        'teacher_id': session.teacher_id,
+        'latitude': session.latitude,
+        'longitude': session.longitude,
+        'comments': session.comments,
+        'signature_url': session.signature_url,
+        'status': session.status,
+        'location_flagged': session.location_flagged,
+        'teacher': {'id': session.teacher.id, 'first_name': session.teacher.first_name, 'last_name': session.teacher.last_name},
+        'avg_score': averages.get((ScoreRollup.SESSION, session.id)),
+        'assistants': by_session[session.id]
+    } for session in sessions]
+    return json.dumps({'content': content}, indent=2)
+
+
+def _compiled(sessions, assistants, averages):
+    context = {'averages': averages, 'assistants': defaultdict(list)}
+    serialize_assistant = serializers.assistant.serialize
+    for assistant in assistants:
+        context['assistants'][assistant.training_session_id].append(serialize_assistant(assistant, context))
+    return serializers.dumps({'content': serializers.session.many(sessions, context)})
+
+
+def _best_of(function, args, repeat):
+    best = None
+    for i in range(repeat):
+        started = time.time()
+        body = function(*args)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def run(sessions=1000, assistants_per_session=15, repeat=5):
+    app = create_app('testing')
+    with app.test_request_context():
+        args = _models(sessions, assistants_per_session)
+        former, former_body = _best_of(_former, args, repeat)
+        compiled, compiled_body = _best_of(_compiled, args, repeat)
+
+    print('%s sessions of %s assistants, best of %s' % (sessions, assistants_per_session, repeat))
+    print('to_json + jsonify:     %8.1f ms %9d bytes' % (former * 1000, len(former_body)))
+    print('schemas + compact:     %8.1f ms %9d bytes' % (compiled * 1000, len(compiled_body)))
+    print('speedup: %.2fx' % (former / compiled))
+
+    return json.loads(former_body) == json.loads(compiled_body)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run(*[int(arg) for arg in sys.argv[1:3]]) else 1)
@@ -0,0 +1,63 @@
+"""Worker mode comparison on the I/O heavy endpoints: sync, gthread and gevent gunicorn workers.
+
+    python -m benchmarks.workers [requests] [concurrency,...] [save.json]
+
+Replays mix_io.json (PATCH add assistants, POST finish) in every mode and concurrency, with
+signatures uploaded to the local S3 stand-in, and prints throughput and p99 per endpoint. Every
+finish request closes an open session of its own: the default seed (python manage.py db seed)
+has 20000, about twice what the default runs finish, seed again or with more --sessions per batch
+for longer runs.
+
+Each mode runs with the same number of workers; gthread and gevent multiply the requests in
+flight by their threads and worker connections, with the pool sized by app.workers.
+"""
+import json
+import os
+import sys
+from app import create_app
+from . import load
+from .s3_stub import S3Stub
+
+MIX_IO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mix_io.json')
+
+MODES = [
+    ('sync', []),
+    ('gthread', ['-k', 'gthread', '--threads', '8']),
+    ('gevent', ['-k', 'gevent', '--worker-connections', '100'])
+]
+
+
+def run(requests=2000, concurrencies=(10, 50, 100), workers=4):
+    stub = S3Stub().start()
+    os.environ.update(SIGNATURE_STORAGE='s3', AWS_ACCESS_KEY='bench', AWS_SECRET_KEY='bench', AWS_BUCKET_NAME='bench',
+                      AWS_S3_HOST=stub.host, AWS_S3_PORT=str(stub.port), AWS_S3_SECURE='false')
+
+    app = create_app(os.environ.get('FLASK_CONFIG') or 'production')
+    results = []
+    try:
+        with app.app_context():
+            for concurrency in concurrencies:
+                for mode, gunicorn_args in MODES:
+                    report = load.run(mix=MIX_IO, requests=requests, concurrency=concurrency, warmup=50,
+                                      workers=workers, gunicorn_args=gunicorn_args)
+                    results.append((mode, concurrency, report))
+    finally:
+        stub.stop()
+
+    print('%-8s %11s %9s %6s %-20s %9s %9s' % ('mode', 'concurrency', 'req/s', 'errors', 'endpoint', 'p50 ms', 'p99 ms'))
+    for mode, concurrency, report in results:
+        errors = sum(endpoint['errors'] for endpoint in report['endpoints'].values())
+        for name, endpoint in sorted(report['endpoints'].items()):
+            print('%-8s %11d %9.1f %6d %-20s %9.1f %9.1f' % (mode, concurrency, report['throughput'], errors, name,
+                                                             endpoint['p50_ms'], endpoint['p99_ms']))
+    return results
+
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrencies = [int(c) for c in sys.argv[2].split(',')] if len(sys.argv) > 2 else (10, 50, 100)
+    results = run(requests, concurrencies)
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], 'w') as f:
+            json.dump([{'mode': mode, 'concurrency': concurrency, 'report': report} for mode, concurrency, report in results],
+                      f, indent=2, sort_keys=True)
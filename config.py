@@ -21,9 +21,67 @@ class Config:
     AWS_ACCESS_KEY = os.environ.get('AWS_ACCESS_KEY')
     AWS_SECRET_KEY = os.environ.get('AWS_SECRET_KEY')
     AWS_BUCKET_NAME = os.environ.get('AWS_BUCKET_NAME')
+    #only for S3 compatible endpoints, empty means AWS
+    AWS_S3_HOST = os.environ.get('AWS_S3_HOST')
+    AWS_S3_PORT = int(os.environ.get('AWS_S3_PORT') or 443)
+    AWS_S3_SECURE = os.environ.get('AWS_S3_SECURE', 'true').lower() == 'true'
+    #files above this size are sent as a multipart upload in parts of this size (S3 minimum is 5MB)
+    AWS_S3_MULTIPART_THRESHOLD = 5 * 1024 * 1024
+
+    #signature storage: 's3' or 'local' (files under LOCAL_STORAGE_DIR, served from LOCAL_STORAGE_URL)
+    SIGNATURE_STORAGE = os.environ.get('SIGNATURE_STORAGE') or 's3'
+    LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR') or os.path.join(basedir, 'storage')
+    LOCAL_STORAGE_URL = os.environ.get('LOCAL_STORAGE_URL') or '/storage'
+
+    #background signature uploads
+    SIGNATURE_SPOOL_DIR = os.environ.get('SIGNATURE_SPOOL_DIR') or os.path.join(basedir, 'spool')
+    SIGNATURE_UPLOAD_WORKERS = 2
+    SIGNATURE_UPLOAD_RETRIES = 5
+    SIGNATURE_UPLOAD_BACKOFF = 1
+    SIGNATURE_MAX_BYTES = 10 * 1024 * 1024
+
+    #list endpoints pagination
+    API_PAGE_SIZE = 100
+    API_MAX_PAGE_SIZE = 1000
+    API_STREAM_CHUNK_SIZE = 500
+
+    #seconds the scenario catalog is served before checking its version
+    SCENARIO_CATALOG_TTL = 60
+
+    #provider/branch/employee responses cache: 'memory' (per worker LRU), 'file' (shared by the
+    #workers of the host) or None. Tag versions always live under RESPONSE_CACHE_DIR
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND') or 'memory'
+    RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR') or os.path.join(basedir, 'cache')
+    RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+    #nearest branch lookups and session location checks
+    BRANCH_INDEX_TTL = 60
+    BRANCH_INDEX_CELL_DEGREES = 0.05  # must divide 360
+    BRANCH_SEARCH_MAX_RADIUS_KM = 200
+    SESSION_MAX_BRANCH_DISTANCE_KM = 5
+
+    #request metrics, every worker writes its counters to METRICS_DIR each METRICS_FLUSH_INTERVAL seconds
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(basedir, 'metrics')
+    METRICS_FLUSH_INTERVAL = 5
+
+    #bulk employee imports: rows per COPY into the staging table, invalid rows reported at most
+    IMPORT_CHUNK_ROWS = 5000
+    IMPORT_MAX_ERRORS = 100
+
+    #rows fetched from the server side cursor per chunk of a batch export
+    EXPORT_CHUNK_ROWS = 1000
+
+    #sessions accepted by one offline sync request
+    SYNC_MAX_ITEMS = 100
+
+    #db pool of the gevent workers, requests above it wait for a connection (see app/workers.py)
+    GEVENT_DB_POOL_SIZE = int(os.environ.get('GEVENT_DB_POOL_SIZE') or 20)
+    GEVENT_DB_MAX_OVERFLOW = 5
 
     #slow queries
     APP_SLOW_DB_QUERY_TIME = 0.5
+    #requests issuing more queries than this are logged (0 disables the check)
+    APP_MAX_QUERIES_PER_REQUEST = int(os.environ.get('APP_MAX_QUERIES_PER_REQUEST') or 20)
 
     #debug sql queries
     SQLALCHEMY_RECORD_QUERIES = True
@@ -44,7 +102,12 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    #the tests empty the tables of this database, never point it to a real one
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL')
     WTF_CSRF_ENABLED = False
+    SIGNATURE_STORAGE = 'local'
+    SIGNATURE_UPLOAD_BACKOFF = 0
+    RESPONSE_CACHE_BACKEND = None
 
 
 class ProductionConfig(Config):
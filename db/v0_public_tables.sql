@@ -0,0 +1,28 @@
+-- the public tables v1 builds on, created by hand on the first databases: this creates them on an
+-- empty database and does nothing where they already exist
+
+CREATE TABLE IF NOT EXISTS public.providers (
+  id SERIAL PRIMARY KEY,
+  name VARCHAR,
+  slug VARCHAR,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.provider_branches (
+  id SERIAL PRIMARY KEY,
+  provider_id INTEGER REFERENCES public.providers (id),
+  name VARCHAR,
+  latitude DOUBLE PRECISION,
+  longitude DOUBLE PRECISION,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.users (
+  id SERIAL PRIMARY KEY,
+  first_name VARCHAR,
+  last_name VARCHAR,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
@@ -0,0 +1,11 @@
+-- idempotency keys of the sessions submitted by POST /training/batches/<id>/sync (app/sync.py):
+-- a retried upload finds its key and gets the session created the first time
+
+CREATE TABLE training.sync_receipts (
+  idempotency_key VARCHAR(64) PRIMARY KEY,
+  training_session_id INTEGER NOT NULL REFERENCES training.training_sessions (id) ON DELETE CASCADE,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+CREATE INDEX sync_receipts_session_id_idx ON training.sync_receipts (training_session_id);
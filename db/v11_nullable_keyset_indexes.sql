@@ -0,0 +1,11 @@
+-- provider, branch and batch names are nullable: the list endpoints page on coalesce(name, ''),
+-- NULL names never satisfy the (name, id) > cursor comparison
+
+DROP INDEX IF EXISTS public.providers_name_id_idx;
+CREATE INDEX providers_name_id_idx ON public.providers ((coalesce(name, '')), id);
+
+DROP INDEX IF EXISTS public.provider_branches_provider_id_name_id_idx;
+CREATE INDEX provider_branches_provider_id_name_id_idx ON public.provider_branches (provider_id, (coalesce(name, '')), id);
+
+DROP INDEX IF EXISTS training.training_batches_name_id_idx;
+CREATE INDEX training_batches_name_id_idx ON training.training_batches ((coalesce(name, '')), id);
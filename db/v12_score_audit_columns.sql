@@ -0,0 +1,8 @@
+-- v1 created the scores without the audit columns every model maps (AuditMixin). The existing
+-- scores keep NULL, their time is unknown: the default only applies to the rows inserted later
+
+ALTER TABLE training.training_session_assistant_scores ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE training.training_session_assistant_scores ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE;
+
+ALTER TABLE training.training_session_assistant_scores ALTER COLUMN created_at SET DEFAULT now();
+ALTER TABLE training.training_session_assistant_scores ALTER COLUMN updated_at SET DEFAULT now();
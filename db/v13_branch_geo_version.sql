@@ -0,0 +1,21 @@
+-- the branch index of app/geo.py is rebuilt when count/max(geo_version) moves. updated_at cannot
+-- be its version: counter_cache (v5) touches it on every employee insert and delete. geo_version
+-- only moves when a column the index holds (provider_id, name, latitude, longitude) changes
+
+CREATE SEQUENCE public.provider_branches_geo_version_seq;
+
+ALTER TABLE public.provider_branches ADD COLUMN geo_version BIGINT NOT NULL DEFAULT nextval('public.provider_branches_geo_version_seq');
+
+CREATE INDEX IF NOT EXISTS provider_branches_geo_version_idx ON public.provider_branches (geo_version);
+
+CREATE OR REPLACE FUNCTION public.branch_geo_version() RETURNS trigger AS $$
+BEGIN
+  IF (NEW.provider_id, NEW.name, NEW.latitude, NEW.longitude) IS DISTINCT FROM (OLD.provider_id, OLD.name, OLD.latitude, OLD.longitude) THEN
+    NEW.geo_version = nextval('public.provider_branches_geo_version_seq');
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER branch_geo_version BEFORE UPDATE ON public.provider_branches
+  FOR EACH ROW EXECUTE PROCEDURE public.branch_geo_version();
@@ -0,0 +1,52 @@
+-- denormalized children counts, kept up to date by triggers so every write path
+-- (ORM, bulk inserts, COPY) maintains them. python manage.py recount repairs them.
+
+ALTER TABLE public.providers ADD COLUMN branches_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE public.provider_branches ADD COLUMN employees_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE training.training_batches ADD COLUMN sessions_count INTEGER NOT NULL DEFAULT 0;
+
+-- TG_ARGV: parent table, counter column, foreign key column on the child table
+CREATE OR REPLACE FUNCTION training.counter_cache() RETURNS trigger AS $$
+DECLARE
+  old_id INTEGER;
+  new_id INTEGER;
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    EXECUTE format('SELECT ($1).%I', TG_ARGV[2]) INTO new_id USING NEW;
+  END IF;
+
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    EXECUTE format('SELECT ($1).%I', TG_ARGV[2]) INTO old_id USING OLD;
+  END IF;
+
+  IF old_id IS NOT DISTINCT FROM new_id THEN
+    RETURN NULL;
+  END IF;
+
+  IF old_id IS NOT NULL THEN
+    EXECUTE format('UPDATE %s SET %I = %I - 1 WHERE id = $1', TG_ARGV[0], TG_ARGV[1], TG_ARGV[1]) USING old_id;
+  END IF;
+
+  IF new_id IS NOT NULL THEN
+    EXECUTE format('UPDATE %s SET %I = %I + 1 WHERE id = $1', TG_ARGV[0], TG_ARGV[1], TG_ARGV[1]) USING new_id;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER provider_branches_counter_cache
+  AFTER INSERT OR DELETE OR UPDATE OF provider_id ON public.provider_branches
+  FOR EACH ROW EXECUTE PROCEDURE training.counter_cache('public.providers', 'branches_count', 'provider_id');
+
+CREATE TRIGGER provider_branch_employees_counter_cache
+  AFTER INSERT OR DELETE OR UPDATE OF provider_branch_id ON training.provider_branch_employees
+  FOR EACH ROW EXECUTE PROCEDURE training.counter_cache('public.provider_branches', 'employees_count', 'provider_branch_id');
+
+CREATE TRIGGER training_sessions_counter_cache
+  AFTER INSERT OR DELETE OR UPDATE OF training_batch_id ON training.training_sessions
+  FOR EACH ROW EXECUTE PROCEDURE training.counter_cache('training.training_batches', 'sessions_count', 'training_batch_id');
+
+UPDATE public.providers p SET branches_count = (SELECT count(*) FROM public.provider_branches b WHERE b.provider_id = p.id);
+UPDATE public.provider_branches b SET employees_count = (SELECT count(*) FROM training.provider_branch_employees e WHERE e.provider_branch_id = b.id);
+UPDATE training.training_batches t SET sessions_count = (SELECT count(*) FROM training.training_sessions s WHERE s.training_batch_id = t.id);
@@ -0,0 +1,7 @@
+-- finishing a session uploads the signature in the background, status tracks that pipeline:
+-- open -> finishing -> finished (or upload_failed once the retries run out)
+
+ALTER TABLE training.training_sessions ADD COLUMN status VARCHAR(20) NOT NULL DEFAULT 'open';
+ALTER TABLE training.training_sessions ADD COLUMN upload_attempts INTEGER NOT NULL DEFAULT 0;
+
+UPDATE training.training_sessions SET status = 'finished' WHERE signature_url IS NOT NULL;
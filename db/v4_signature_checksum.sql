@@ -0,0 +1,5 @@
+-- signatures are stored under their sha256, sessions sharing a signature share the object
+
+ALTER TABLE training.training_sessions ADD COLUMN signature_sha256 VARCHAR(64);
+
+CREATE INDEX training_sessions_signature_sha256_idx ON training.training_sessions (signature_sha256);
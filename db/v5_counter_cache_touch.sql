@@ -0,0 +1,31 @@
+-- counter_cache also touches the parent's updated_at, so a parent's updated_at moves whenever
+-- the counts it embeds do; conditional GETs rely on it (app/api/conditional.py)
+
+CREATE OR REPLACE FUNCTION training.counter_cache() RETURNS trigger AS $$
+DECLARE
+  old_id INTEGER;
+  new_id INTEGER;
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    EXECUTE format('SELECT ($1).%I', TG_ARGV[2]) INTO new_id USING NEW;
+  END IF;
+
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    EXECUTE format('SELECT ($1).%I', TG_ARGV[2]) INTO old_id USING OLD;
+  END IF;
+
+  IF old_id IS NOT DISTINCT FROM new_id THEN
+    RETURN NULL;
+  END IF;
+
+  IF old_id IS NOT NULL THEN
+    EXECUTE format('UPDATE %s SET %I = %I - 1, updated_at = now() WHERE id = $1', TG_ARGV[0], TG_ARGV[1], TG_ARGV[1]) USING old_id;
+  END IF;
+
+  IF new_id IS NOT NULL THEN
+    EXECUTE format('UPDATE %s SET %I = %I + 1, updated_at = now() WHERE id = $1', TG_ARGV[0], TG_ARGV[1], TG_ARGV[1]) USING new_id;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
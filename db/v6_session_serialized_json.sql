@@ -0,0 +1,4 @@
+-- finished sessions can't change anymore, their json is rendered once and served as is
+-- python manage.py backfill_sessions_json fills it in for the sessions finished before
+
+ALTER TABLE training.training_sessions ADD COLUMN serialized_json TEXT;
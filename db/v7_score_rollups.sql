@@ -0,0 +1,39 @@
+-- running sum/count/min/max of the scores per assistant, session, batch and scenario, updated in
+-- the same transaction as the score inserts (app/rollups.py), so averages are a primary key read.
+-- python manage.py rebuild_rollups recomputes them from training_session_assistant_scores
+
+CREATE TABLE training.score_rollups (
+  scope VARCHAR(20) NOT NULL,
+  scope_id INTEGER NOT NULL,
+  score_sum NUMERIC NOT NULL,
+  score_count INTEGER NOT NULL,
+  score_min NUMERIC NOT NULL,
+  score_max NUMERIC NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+  PRIMARY KEY (scope, scope_id)
+);
+
+INSERT INTO training.score_rollups (scope, scope_id, score_sum, score_count, score_min, score_max)
+SELECT 'assistant', a.id, sum(sc.score), count(*), min(sc.score), max(sc.score)
+FROM training.training_session_assistant_scores sc
+JOIN training.training_session_assistants a ON a.id = sc.training_session_assistant_id
+GROUP BY a.id;
+
+INSERT INTO training.score_rollups (scope, scope_id, score_sum, score_count, score_min, score_max)
+SELECT 'session', a.training_session_id, sum(sc.score), count(*), min(sc.score), max(sc.score)
+FROM training.training_session_assistant_scores sc
+JOIN training.training_session_assistants a ON a.id = sc.training_session_assistant_id
+GROUP BY a.training_session_id;
+
+INSERT INTO training.score_rollups (scope, scope_id, score_sum, score_count, score_min, score_max)
+SELECT 'batch', s.training_batch_id, sum(sc.score), count(*), min(sc.score), max(sc.score)
+FROM training.training_session_assistant_scores sc
+JOIN training.training_session_assistants a ON a.id = sc.training_session_assistant_id
+JOIN training.training_sessions s ON s.id = a.training_session_id
+GROUP BY s.training_batch_id;
+
+INSERT INTO training.score_rollups (scope, scope_id, score_sum, score_count, score_min, score_max)
+SELECT 'scenario', sc.training_scenario_id, sum(sc.score), count(*), min(sc.score), max(sc.score)
+FROM training.training_session_assistant_scores sc
+GROUP BY sc.training_scenario_id;
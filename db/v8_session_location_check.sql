@@ -0,0 +1,4 @@
+-- sessions record how far they were started from their branch and whether that is implausible
+
+ALTER TABLE training.training_sessions ADD COLUMN branch_distance_km DOUBLE PRECISION;
+ALTER TABLE training.training_sessions ADD COLUMN location_flagged BOOLEAN NOT NULL DEFAULT false;
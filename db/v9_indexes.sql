@@ -0,0 +1,23 @@
+-- indexes for the foreign keys and the lookups/keyset orders of the endpoints.
+-- python manage.py db check_plans verifies no endpoint query falls back to a sequential scan
+
+CREATE UNIQUE INDEX IF NOT EXISTS providers_slug_key ON public.providers (slug);
+CREATE INDEX IF NOT EXISTS providers_name_id_idx ON public.providers (name, id);
+
+CREATE INDEX IF NOT EXISTS provider_branches_provider_id_name_id_idx ON public.provider_branches (provider_id, name, id);
+
+CREATE INDEX IF NOT EXISTS provider_branch_employees_branch_name_id_idx ON training.provider_branch_employees (provider_branch_id, name, id);
+
+CREATE INDEX IF NOT EXISTS training_batches_name_id_idx ON training.training_batches (name, id);
+
+CREATE INDEX IF NOT EXISTS training_sessions_batch_id_idx ON training.training_sessions (training_batch_id, id);
+CREATE INDEX IF NOT EXISTS training_sessions_provider_branch_id_idx ON training.training_sessions (provider_branch_id);
+CREATE INDEX IF NOT EXISTS training_sessions_teacher_id_idx ON training.training_sessions (teacher_id);
+CREATE INDEX IF NOT EXISTS training_sessions_pending_upload_idx ON training.training_sessions (status)
+  WHERE status IN ('finishing', 'upload_failed');
+
+CREATE INDEX IF NOT EXISTS training_session_assistants_session_id_idx ON training.training_session_assistants (training_session_id);
+CREATE INDEX IF NOT EXISTS training_session_assistants_employee_id_idx ON training.training_session_assistants (provider_branch_employee_id);
+
+CREATE INDEX IF NOT EXISTS training_session_assistant_scores_assistant_id_idx ON training.training_session_assistant_scores (training_session_assistant_id);
+CREATE INDEX IF NOT EXISTS training_session_assistant_scores_scenario_id_idx ON training.training_session_assistant_scores (training_scenario_id);
@@ -33,24 +33,99 @@ def make_shell_context():
                     User=User)
 
 manager.add_command('shell', Shell(make_context=make_shell_context))
-# manager.add_command('db', MigrateCommand)
+
+migrate_manager = Manager(usage='Database migrations, seed data and query plan checks')
+
+
+@migrate_manager.option('-v', '--version', dest='target', type=int, default=None, help='stop at this version')
+def upgrade(target):
+    """Apply the pending db/vN_name.sql scripts."""
+    from app.migrations import upgrade as upgrade_schema
+    ran = upgrade_schema(target)
+    for version, name in ran:
+        print('v%s %s applied' % (version, name))
+    if not ran:
+        print('database is up to date')
+
+
+@migrate_manager.command
+def status():
+    """List the migrations and whether they were applied."""
+    from app.migrations import status as migrations_status
+    for version, name, done in migrations_status():
+        print('v%s %s: %s' % (version, name, 'applied' if done else 'pending'))
+
+
+@migrate_manager.option('-v', '--version', dest='target', type=int, required=True, help='last version already in the database')
+def baseline(target):
+    """Mark the migrations up to a version as applied, for databases created by hand."""
+    from app.migrations import baseline as baseline_schema
+    for version, name in baseline_schema(target):
+        print('v%s %s marked as applied' % (version, name))
+
+
+@migrate_manager.option('-s', '--seed', dest='seed', type=float, default=0.42)
+@migrate_manager.option('--providers', dest='providers', type=int)
+@migrate_manager.option('--branches', dest='branches_per_provider', type=int)
+@migrate_manager.option('--employees', dest='employees_per_branch', type=int)
+@migrate_manager.option('--batches', dest='batches', type=int)
+@migrate_manager.option('--sessions', dest='sessions_per_batch', type=int)
+@migrate_manager.option('--assistants', dest='assistants_per_session', type=int)
+def seed(seed, **volumes):
+    """Fill the database with a reproducible synthetic dataset."""
+    from benchmarks.seed import seed as seed_database
+    for key, value in sorted(seed_database(seed, **volumes).items()):
+        print('%s: %s' % (key, value))
+
+
+@migrate_manager.option('-m', '--min-rows', dest='min_rows', type=int, default=10000)
+def check_plans(min_rows):
+    """EXPLAIN the endpoint queries, fail on sequential scans of large tables."""
+    from benchmarks.plans import check_plans as check
+    failed = False
+    for endpoint, tables in check(min_rows):
+        print('%s: %s' % (endpoint, 'seq scan on %s' % ', '.join(tables) if tables else 'ok'))
+        failed = failed or bool(tables)
+    if failed:
+        raise SystemExit(1)
+
+manager.add_command('db', migrate_manager)
 
 
 @manager.option('-h', '--host', dest='host', default='0.0.0.0')
 @manager.option('-p', '--port', dest='port', type=int, default=5000)
 @manager.option('-w', '--workers', dest='workers', type=int, default=10)
 @manager.option('-t', '--timeout', dest='timeout', type=int, default=90)
-def gunicorn(host, port, workers, timeout):
+@manager.option('-k', '--worker-class', dest='worker_class', default='sync', help='sync, gthread or gevent')
+@manager.option('--threads', dest='threads', type=int, default=1, help='request threads of each gthread worker')
+@manager.option('--worker-connections', dest='worker_connections', type=int, default=1000, help='concurrent requests of each gevent worker')
+def gunicorn(host, port, workers, timeout, worker_class, threads, worker_connections):
     """Start the Server with Gunicorn"""
     from gunicorn.app.base import Application
+    from app.metrics import metrics
+    from app.workers import configure_pool, make_psycopg2_green
+
+    # counters of the previous run's workers
+    metrics.clear()
+
+    if worker_class == 'gthread' and threads < 2:
+        threads = 4
+
+    configure_pool(app, worker_class, workers, threads, worker_connections)
+
+    options = {
+        'bind': '{0}:{1}'.format(host, port),
+        'workers': workers, 'timeout': timeout,
+        'worker_class': worker_class, 'threads': threads, 'worker_connections': worker_connections
+    }
+
+    if worker_class == 'gevent':
+        # the worker monkey patches the standard library before this hook, psycopg2 is left to us
+        options['post_worker_init'] = lambda worker: make_psycopg2_green()
 
     class FlaskApplication(Application):
         def init(self, parser, opts, args):
-            return {
-                'bind': '{0}:{1}'.format(host, port),
-                'workers': workers, 'timeout': timeout
-
-            }
+            return options
 
         def load(self):
             return app
@@ -59,6 +134,124 @@ def gunicorn(host, port, workers, timeout):
     return application.run()
 
 
+@manager.command
+def test():
+    """Run the unit tests."""
+    import unittest
+    tests = unittest.TestLoader().discover('tests')
+    result = unittest.TextTestRunner(verbosity=2).run(tests)
+    if not result.wasSuccessful():
+        raise SystemExit(1)
+
+
+@manager.command
+def recount():
+    """Repair the branches/employees/sessions counter cache columns."""
+    from app.counters import recount as recount_counters
+    for counter, rows in sorted(recount_counters().items()):
+        print('%s: %s rows repaired' % (counter, rows))
+
+
+@manager.command
+def resume_uploads():
+    """Upload the signatures left in the spool by finishing or failed sessions."""
+    from app.uploads import signature_uploader
+    for session_id in signature_uploader.pending():
+        print('session %s: %s' % (session_id, 'uploaded' if signature_uploader.upload(session_id) else 'failed'))
+
+
+@manager.command
+def rebuild_rollups():
+    """Recompute the score rollups from training_session_assistant_scores."""
+    from app.rollups import rebuild
+    for scope, rows in rebuild():
+        print('%s: %s rollups' % (scope, rows))
+
+
+@manager.option('-f', '--force', dest='force', action='store_true', default=False, help='render every finished session again')
+def backfill_sessions_json(force):
+    """Store the rendered json of finished sessions."""
+    from app.loaders import backfill_sessions_json as backfill
+    print('%s sessions rendered' % backfill(force=force))
+
+
+@manager.option('-f', '--file', dest='path', required=True, help='csv (branch_id,name,phone,title header) or ndjson file')
+@manager.option('-p', '--provider', dest='slug', default=None, help='reject rows of branches of other providers')
+@manager.option('--format', dest='format', default=None, help='csv or ndjson, by default from the file extension')
+def import_employees(path, slug, format):
+    """Bulk load employees from a csv or ndjson file."""
+    from app.imports import import_employees as load
+
+    provider_id = None
+    if slug is not None:
+        provider = Provider.query.filter(Provider.slug == slug).first()
+        if provider is None:
+            raise SystemExit('provider %s does not exist' % slug)
+        provider_id = provider.id
+
+    with open(path, 'rb') as f:
+        result = load(f, format or os.path.splitext(path)[1].lstrip('.').lower(), provider_id=provider_id)
+    db.session.commit()
+
+    for error in result['errors']:
+        print('line %s: %s' % (error['line'], error['message']))
+    print('%s employees imported, %s rows rejected' % (result['imported'], result['rejected']))
+
+
+@manager.option('-b', '--batch', dest='batch_id', type=int, required=True)
+@manager.option('-f', '--format', dest='format', default='csv', help='csv or ndjson')
+@manager.option('-o', '--output', dest='path', required=True, help='file to write, .gz compresses it')
+def export_batch(batch_id, format, path):
+    """Export the scores of a batch, one row per score."""
+    from app.exports import export_batch as export
+
+    if TrainingBatch.query.get(batch_id) is None:
+        raise SystemExit('batch %s does not exist' % batch_id)
+
+    size = 0
+    with open(path, 'wb') as f:
+        for chunk in export(batch_id, format, compress=path.endswith('.gz')):
+            f.write(chunk)
+            size += len(chunk)
+    print('batch %s exported to %s, %s bytes' % (batch_id, path, size))
+
+
+@manager.option('-u', '--url', dest='url', default=None, help='server to load, by default a gunicorn started for the run')
+@manager.option('-m', '--mix', dest='mix', default=None, help='endpoint mix json file')
+@manager.option('-n', '--requests', dest='requests', type=int, default=5000)
+@manager.option('-c', '--concurrency', dest='concurrency', type=int, default=10)
+@manager.option('-w', '--workers', dest='workers', type=int, default=10)
+@manager.option('--seed', dest='seed', type=int, default=0)
+@manager.option('--save', dest='save', default=None, help='write the report to this file as the new baseline')
+@manager.option('--baseline', dest='baseline', default=None, help='fail on regressions against this report')
+@manager.option('--threshold', dest='threshold', type=float, default=0.2, help='tolerated p95/throughput change')
+@manager.option('-k', '--worker-class', dest='worker_class', default='sync', help='worker class of the gunicorn started for the run')
+@manager.option('--threads', dest='threads', type=int, default=1, help='request threads of each gthread worker')
+def benchmark(url, mix, requests, concurrency, workers, seed, save, baseline, threshold, worker_class, threads):
+    """Replay an endpoint mix against gunicorn and report latency, throughput and queries per endpoint."""
+    import json
+    from benchmarks import load
+
+    gunicorn_args = ['-k', worker_class, '--threads', str(threads)]
+    report = load.run(url=url, mix=mix or load.MIX, requests=requests, concurrency=concurrency, workers=workers, seed=seed,
+                      gunicorn_args=gunicorn_args)
+    load.print_report(report)
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('baseline saved to %s' % save)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = load.compare(report, json.load(f), threshold)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            raise SystemExit(1)
+        print('no regressions against %s' % baseline)
+
+
 @manager.command
 def profile(length=25, profile_dir=None):
     """Start de application under the code profiler."""
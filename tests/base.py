@@ -0,0 +1,71 @@
+import os
+import unittest
+from collections import OrderedDict
+from app import create_app, db
+from app.models import Provider, ProviderBranch, ProviderBranchEmployee, User, TrainingScenario, TrainingBatch, TrainingSession
+from app.scoring import add_session_assistants
+from app.catalog import scenario_catalog
+from app.geo import branch_locator
+
+# every table the tests write to, emptied after each test
+TABLES = ('public.providers', 'public.provider_branches', 'public.users',
+          'training.provider_branch_employees', 'training.training_scenarios', 'training.training_batches',
+          'training.training_sessions', 'training.training_session_assistants',
+          'training.training_session_assistant_scores', 'training.score_rollups', 'training.sync_receipts')
+
+
+@unittest.skipUnless(os.environ.get('TEST_DATABASE_URL'), 'TEST_DATABASE_URL is not set')
+class DatabaseTestCase(unittest.TestCase):
+    """Runs against the postgres database of TEST_DATABASE_URL, migrated to the last version."""
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        from app.migrations import upgrade
+        upgrade()
+
+        # the per worker caches would outlive the rows of the previous test
+        scenario_catalog.invalidate()
+        branch_locator.invalidate()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.session.execute('TRUNCATE %s RESTART IDENTITY CASCADE' % ', '.join(TABLES))
+        db.session.commit()
+        db.session.remove()
+        self.app_context.pop()
+
+    def add(self, instance):
+        db.session.add(instance)
+        db.session.commit()
+        return instance
+
+    def add_branch(self, slug='provider', name='Branch', latitude=14.6, longitude=-90.5):
+        provider = Provider.query.filter(Provider.slug == slug).first() or self.add(Provider(name=slug.title(), slug=slug))
+        return self.add(ProviderBranch(provider_id=provider.id, name=name, latitude=latitude, longitude=longitude))
+
+    def add_employee(self, branch, name='Employee'):
+        return self.add(ProviderBranchEmployee(provider_branch_id=branch.id, name=name))
+
+    def add_session(self, batch, branch, teacher, scores=()):
+        """A session of batch, scores are (employee, scenario, score) triples."""
+        session = self.add(TrainingSession(training_batch_id=batch.id, provider_branch_id=branch.id, teacher_id=teacher.id,
+                                           latitude=branch.latitude, longitude=branch.longitude))
+        assistants = OrderedDict()
+        for employee, scenario, score in scores:
+            assistant = assistants.setdefault(employee.id, {'employee_id': employee.id, 'results': []})
+            assistant['results'].append({'scenario_id': scenario.id, 'score': score})
+        add_session_assistants(session, list(assistants.values()))
+        db.session.commit()
+        return session
+
+    def add_fixtures(self):
+        """A provider with a branch of two employees, two scenarios, a teacher and a batch."""
+        self.branch = self.add_branch()
+        self.employees = [self.add_employee(self.branch, name) for name in ('Ana', 'Luis')]
+        self.scenarios = [self.add(TrainingScenario(description=description)) for description in ('Agregar Productos', 'Validar autorizacion')]
+        self.teacher = self.add(User(first_name='Maria', last_name='Lopez'))
+        self.batch = self.add(TrainingBatch(name='Primera Capacitacion'))
@@ -0,0 +1,26 @@
+import unittest
+from sqlalchemy import event
+from flask.ext.sqlalchemy import SignallingSession
+from app import create_app, db
+from app import cache
+
+
+class BasicsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+
+    def test_app_is_testing(self):
+        self.assertTrue(self.app.config['TESTING'])
+
+    def test_cache_listens_to_session_events(self):
+        self.assertTrue(event.contains(SignallingSession, 'after_flush', cache._collect_tags))
+        self.assertTrue(event.contains(SignallingSession, 'after_commit', cache._invalidate_tags))
+        self.assertTrue(event.contains(SignallingSession, 'after_rollback', cache._discard_tags))
+        self.assertIsInstance(db.session(), SignallingSession)
@@ -0,0 +1,37 @@
+from tests.base import DatabaseTestCase
+from app import db
+from app.models import Provider, ProviderBranchEmployee
+
+
+class CacheTagsTestCase(DatabaseTestCase):
+
+    def flushed_tags(self):
+        db.session.flush()
+        return db.session().info.get('cache_tags', set())
+
+    def test_renamed_slug_invalidates_both_slugs(self):
+        self.add_branch(slug='acme')
+        provider = Provider.query.filter(Provider.slug == 'acme').one()
+
+        provider.slug = 'acme-gt'
+        tags = self.flushed_tags()
+
+        self.assertIn('provider:acme', tags)
+        self.assertIn('provider:acme-gt', tags)
+        self.assertIn('providers', tags)
+        db.session.commit()
+
+    def test_moved_employee_invalidates_both_branches(self):
+        first = self.add_branch(slug='acme', name='First')
+        second = self.add_branch(slug='other', name='Second')
+        employee = self.add_employee(first)
+
+        employee = ProviderBranchEmployee.query.get(employee.id)
+        employee.provider_branch_id = second.id
+        tags = self.flushed_tags()
+
+        self.assertIn('branch:%s' % first.id, tags)
+        self.assertIn('branch:%s' % second.id, tags)
+        self.assertIn('provider:acme', tags)
+        self.assertIn('provider:other', tags)
+        db.session.commit()
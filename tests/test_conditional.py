@@ -0,0 +1,44 @@
+from tests.base import DatabaseTestCase
+from app.models import ProviderBranch
+
+
+class ConditionalTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(ConditionalTestCase, self).setUp()
+        self.add_fixtures()
+        self.session = self.add_session(self.batch, self.branch, self.teacher,
+                                        [(self.employees[0], self.scenarios[0], 80)])
+
+    def urls(self):
+        return ['/training/providers',
+                '/training/providers/provider/branches',
+                '/training/providers/provider/branches/%s/employees' % self.branch.id,
+                '/training/scenarios',
+                '/training/batches',
+                '/training/batches/%s/stats' % self.batch.id,
+                '/training/batches/%s/sessions' % self.batch.id,
+                '/training/batches/%s/sessions/%s' % (self.batch.id, self.session.id)]
+
+    def test_if_none_match_answers_not_modified(self):
+        for url in self.urls():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            etag = response.headers.get('ETag')
+            self.assertIsNotNone(etag, url)
+            self.assertIsNotNone(response.headers.get('Last-Modified'), url)
+
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.headers.get('ETag'), etag, url)
+            self.assertEqual(response.get_data(), b'', url)
+
+    def test_changed_rows_change_the_etag(self):
+        url = '/training/providers/provider/branches'
+        etag = self.client.get(url).headers['ETag']
+
+        self.add(ProviderBranch(provider_id=self.branch.provider_id, name='Second branch'))
+
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
@@ -0,0 +1,54 @@
+import csv
+import gzip
+import io
+import json
+import re
+from tests.base import DatabaseTestCase
+from app.exports import NAMES
+
+
+class ExportTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.add_fixtures()
+        self.add_session(self.batch, self.branch, self.teacher,
+                         [(self.employees[0], self.scenarios[0], 80), (self.employees[0], self.scenarios[1], 60),
+                          (self.employees[1], self.scenarios[0], 95)])
+        self.add_session(self.batch, self.branch, self.teacher, [(self.employees[1], self.scenarios[1], 70)])
+
+    def export(self, query=''):
+        response = self.client.get('/training/batches/%s/export%s' % (self.batch.id, query))
+        return response, response.get_data()
+
+    def test_csv(self):
+        response, data = self.export()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        rows = list(csv.reader(io.StringIO(data.decode('utf-8'))))
+        self.assertEqual(rows[0], NAMES)
+        self.assertEqual([row[NAMES.index('score')] for row in rows[1:]], ['80', '60', '95', '70'])
+        self.assertEqual(set(row[NAMES.index('batch_name')] for row in rows[1:]), set(['Primera Capacitacion']))
+
+    def test_ndjson_with_iso_timestamps(self):
+        response, data = self.export('?format=ndjson')
+
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(sorted(rows[0]), sorted(NAMES))
+        self.assertEqual(rows[0]['employee_name'], 'Ana')
+        # isoformat, not the HTTP dates of the api responses
+        self.assertTrue(re.match(r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d', rows[0]['session_created_at']))
+
+    def test_gzip_is_the_same_export_compressed(self):
+        plain = self.export('?format=ndjson')[1]
+        response, compressed = self.export('?format=ndjson&gzip=true')
+
+        self.assertEqual(response.mimetype, 'application/gzip')
+        self.assertIn('batch-%s.ndjson.gz' % self.batch.id, response.headers['Content-Disposition'])
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(compressed)).read(), plain)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.export('?format=xml')[0].status_code, 422)
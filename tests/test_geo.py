@@ -0,0 +1,38 @@
+import random
+import unittest
+from app.geo import BranchIndex, haversine_km
+
+
+class BranchIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        generator = random.Random(42)
+        # dense around the antimeridian and the poles, where the ring bounds are the tightest
+        self.points = [(i, i % 3, 'Branch %s' % i, generator.uniform(-90, 90), generator.uniform(-180, 180)) for i in range(300)] + \
+                      [(300 + i, i % 3, 'Branch %s' % (300 + i), generator.uniform(80, 90), generator.uniform(170, 180)) for i in range(100)] + \
+                      [(400 + i, i % 3, 'Branch %s' % (400 + i), generator.uniform(-20, 20), generator.uniform(-180, -175)) for i in range(100)]
+        self.generator = generator
+
+    def brute_force(self, latitude, longitude, k, radius_km=None, provider_id=None):
+        found = [(haversine_km(latitude, longitude, point[3], point[4]), point) for point in self.points
+                 if provider_id is None or point[1] == provider_id]
+        found = [pair for pair in found if radius_km is None or pair[0] <= radius_km]
+        return [point[0] for distance, point in sorted(found, key=lambda pair: pair[0])[:k]]
+
+    def test_nearest_matches_a_full_scan(self):
+        for cell_degrees in (0.05, 1, 2.5):
+            index = BranchIndex(self.points, cell_degrees)
+            for i in range(200):
+                latitude = self.generator.uniform(-90, 90) if i % 2 else self.generator.choice([89.9, -89.9, 0.0])
+                longitude = self.generator.uniform(-180, 180) if i % 3 else self.generator.choice([179.99, -179.99])
+                k = self.generator.randint(1, 10)
+                radius_km = self.generator.choice([None, 50, 500, 5000])
+                provider_id = self.generator.choice([None, 1])
+
+                expected = self.brute_force(latitude, longitude, k, radius_km, provider_id)
+                found = [point[0] for distance, point in index.nearest(latitude, longitude, k, radius_km, provider_id)]
+                self.assertEqual(found, expected, (cell_degrees, latitude, longitude, k, radius_km, provider_id))
+
+    def test_cell_degrees_must_divide_360(self):
+        self.assertRaises(ValueError, BranchIndex, self.points, 7)
+        self.assertRaises(ValueError, BranchIndex, self.points, 0)
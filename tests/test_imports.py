@@ -0,0 +1,61 @@
+import json
+from tests.base import DatabaseTestCase
+from app.models import ProviderBranchEmployee
+
+
+class ImportTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(ImportTestCase, self).setUp()
+        self.branch = self.add_branch()
+
+    def post(self, data, content_type='text/csv', query=''):
+        response = self.client.post('/training/providers/provider/employees/import' + query,
+                                    data=data.encode('utf-8'), content_type=content_type)
+        return response.status_code, json.loads(response.get_data(as_text=True))
+
+    def test_invalid_rows_are_reported_without_aborting_the_file(self):
+        data = u'branch_id,name,phone,title\n' \
+               u'%(branch)s,Ana,555-0101,Cajera\n' \
+               u'%(branch)s,%(long_name)s,,\n' \
+               u'%(branch)s,Luis,%(long_phone)s,\n' \
+               u'%(branch)s,Nul\x00,,\n' \
+               u'%(branch)s,Marta,,Gerente\n' % {'branch': self.branch.id, 'long_name': u'n' * 151, 'long_phone': u'5' * 51}
+
+        status, result = self.post(data)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(result['imported'], 2)
+        self.assertEqual(result['rejected'], 3)
+        self.assertEqual([error['line'] for error in result['errors']], [3, 4, 5])
+        self.assertEqual(sorted(name for name, in ProviderBranchEmployee.query.with_entities(ProviderBranchEmployee.name)),
+                         ['Ana', 'Marta'])
+
+    def test_ndjson_with_a_default_branch(self):
+        other = self.add_branch(slug='other')
+        data = u'\n'.join([
+            json.dumps({'name': 'Ana', 'title': 'Cajera'}),
+            json.dumps({'name': 'Luis', 'branch_id': self.branch.id}),
+            u'not json',
+            json.dumps({'phone': '555-0101'}),
+            json.dumps({'name': 'Pedro', 'branch_id': 999999}),
+            json.dumps({'name': 'Marta', 'branch_id': other.id}),
+        ]) + u'\n'
+
+        status, result = self.post(data, 'application/x-ndjson', '?branch_id=%s' % self.branch.id)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(result['imported'], 2)
+        self.assertEqual(result['rejected'], 4)
+        # a branch of another provider is as unknown as one that does not exist
+        self.assertEqual([(error['line'], error['message']) for error in result['errors']],
+                         [(3, 'not valid json'), (4, 'Name cannot be empty'),
+                          (5, 'Branch 999999 does not exist'), (6, 'Branch %s does not exist' % other.id)])
+        self.assertEqual(self.branch.employees.count(), 2)
+        self.assertEqual(other.employees.count(), 0)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post(u'name\nAna\n', 'text/plain')[0], 422)
+        self.assertEqual(self.post(u'name\nAna\n', query='?branch_id=abc')[0], 422)
+        self.assertEqual(self.client.post('/training/providers/missing/employees/import', data=b'name\n',
+                                          content_type='text/csv').status_code, 404)
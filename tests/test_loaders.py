@@ -0,0 +1,36 @@
+from flask.ext.sqlalchemy import get_debug_queries
+from tests.base import DatabaseTestCase
+from app import db
+from app.models import TrainingSession
+from app.loaders import sessions_query, sessions_to_json
+
+# sessions + teachers, assistants + employees, session and assistant score rollups
+SESSIONS_TO_JSON_MAX_QUERIES = 3
+
+
+class LoadersTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(LoadersTestCase, self).setUp()
+        self.add_fixtures()
+        for score in (60, 70, 80, 90):
+            self.add_session(self.batch, self.branch, self.teacher,
+                             [(self.employees[0], self.scenarios[0], score), (self.employees[0], self.scenarios[1], 100),
+                              (self.employees[1], self.scenarios[0], score)])
+        db.session.expire_all()
+
+    def test_sessions_to_json_query_count_does_not_depend_on_the_batch_size(self):
+        sessions = sessions_query().filter(TrainingSession.training_batch_id == self.batch.id).order_by(TrainingSession.id)
+
+        before = len(get_debug_queries())
+        content = sessions_to_json(sessions)
+        issued = len(get_debug_queries()) - before
+
+        self.assertLessEqual(issued, SESSIONS_TO_JSON_MAX_QUERIES)
+        self.assertEqual(len(content), 4)
+        for session, score in zip(content, (60, 70, 80, 90)):
+            self.assertEqual(session['teacher']['first_name'], 'Maria')
+            self.assertEqual([assistant['employee']['name'] for assistant in session['assistants']], ['Ana', 'Luis'])
+            self.assertAlmostEqual(float(session['assistants'][0]['score']), (score + 100) / 2.0)
+            self.assertAlmostEqual(float(session['assistants'][1]['score']), score)
+            self.assertAlmostEqual(float(session['avg_score']), (2 * score + 100) / 3.0)
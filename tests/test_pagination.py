@@ -0,0 +1,48 @@
+import json
+from tests.base import DatabaseTestCase
+from app.models import Provider
+
+
+class PaginationTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(PaginationTestCase, self).setUp()
+        # NULL names page as '', before every other name
+        for name in ('Beta', None, 'Alfa', None, 'Gamma', 'Alfa'):
+            self.add(Provider(name=name))
+
+    def get(self, url):
+        response = self.client.get(url)
+        return response.status_code, json.loads(response.get_data(as_text=True))
+
+    def test_pages_cover_every_row_once_in_key_order(self):
+        expected = [provider.id for provider in
+                    sorted(Provider.query.all(), key=lambda provider: (provider.name or '', provider.id))]
+
+        seen = []
+        url = '/training/providers?limit=2&fields=id,name'
+        while True:
+            status, body = self.get(url)
+            self.assertEqual(status, 200)
+            self.assertLessEqual(len(body['content']), 2)
+            seen.extend(provider['id'] for provider in body['content'])
+            if body['next_cursor'] is None:
+                break
+            url = '/training/providers?limit=2&fields=id,name&cursor=%s' % body['next_cursor']
+
+        self.assertEqual(seen, expected)
+
+    def test_count_and_stream(self):
+        status, body = self.get('/training/providers?limit=4&count=true')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['total_elements'], 6)
+        self.assertEqual(len(body['content']), 4)
+
+        status, body = self.get('/training/providers?stream=true')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['total_elements'], 6)
+        self.assertEqual(len(body['content']), 6)
+
+    def test_invalid_cursor_and_limit(self):
+        self.assertEqual(self.get('/training/providers?cursor=not-a-cursor')[0], 422)
+        self.assertEqual(self.get('/training/providers?limit=0')[0], 422)
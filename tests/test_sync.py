@@ -0,0 +1,69 @@
+import base64
+import json
+from tests.base import DatabaseTestCase
+from app.models import TrainingSession, SyncReceipt
+
+
+class SyncTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(SyncTestCase, self).setUp()
+        self.add_fixtures()
+
+    def item(self, key, **fields):
+        item = {'idempotency_key': key, 'provider_branch_id': self.branch.id, 'teacher_id': self.teacher.id,
+                'latitude': self.branch.latitude, 'longitude': self.branch.longitude,
+                'assistants': [{'employee_id': self.employees[0].id,
+                                'results': [{'scenario_id': self.scenarios[0].id, 'score': 90}]}]}
+        item.update(fields)
+        return item
+
+    def sync(self, items):
+        response = self.client.post('/training/batches/%s/sync' % self.batch.id,
+                                    data=json.dumps({'sessions': items}), content_type='application/json')
+        return response.status_code, json.loads(response.get_data(as_text=True))
+
+    def test_retried_upload_does_not_create_the_sessions_again(self):
+        items = [self.item('a'), self.item('b')]
+
+        status, first = self.sync(items)
+        self.assertEqual(status, 200)
+        self.assertEqual([result['status'] for result in first['content']], ['created', 'created'])
+
+        status, second = self.sync(items + [self.item('c')])
+        self.assertEqual(status, 200)
+        self.assertEqual([result['status'] for result in second['content']], ['duplicate', 'duplicate', 'created'])
+        self.assertEqual([result['session_id'] for result in second['content'][:2]],
+                         [result['session_id'] for result in first['content']])
+
+        self.assertEqual(TrainingSession.query.count(), 3)
+        self.assertEqual(SyncReceipt.query.count(), 3)
+
+    def test_failing_items_are_reported_alone(self):
+        items = [self.item('ok'),
+                 self.item('no-results', assistants=[{'employee_id': self.employees[0].id}]),
+                 self.item('no-teacher', teacher_id=999999),
+                 self.item('long-comments', finish={'comments': u'x' * 513,
+                                                    'signature_base64': base64.b64encode(b'signature').decode('ascii')}),
+                 self.item(''),
+                 'not an object',
+                 self.item('ok-too')]
+
+        status, body = self.sync(items)
+
+        self.assertEqual(status, 200)
+        self.assertEqual([result['status'] for result in body['content']],
+                         ['created', 'error', 'error', 'error', 'error', 'error', 'created'])
+        self.assertEqual(body['content'][2]['message'], 'Teacher 999999 does not exist')
+        self.assertEqual(TrainingSession.query.count(), 2)
+        self.assertEqual(SyncReceipt.query.count(), 2)
+
+    def test_finished_items_are_queued_for_upload(self):
+        finish = {'comments': 'ok', 'signature_base64': base64.b64encode(b'signature').decode('ascii')}
+
+        status, body = self.sync([self.item('finished', finish=finish)])
+
+        self.assertEqual(body['content'][0]['status'], 'created')
+        session = TrainingSession.query.get(body['content'][0]['session_id'])
+        self.assertIn(session.status, (TrainingSession.FINISHING, TrainingSession.FINISHED))
+        self.assertIsNotNone(session.signature_sha256)